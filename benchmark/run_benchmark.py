@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+__author__ = 'Mobidic'
+__authors__ = ['Henri Pegeot','Kevin Yauy','Charles Van Goethem','David Baux']
+__copyright__ = 'Copyright (C) 2019'
+__license__ = 'Academic License Agreement'
+__version__ = '1.1.2'
+__email__ = 'h-pegeot@chu-montpellier.fr'
+__status__ = 'prod'
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import os         # os command
+import sys        # system command
+import json       # results of one case
+import shutil     # remove work directory
+import argparse   # for options
+import logging    # logging messages
+import resource   # peak memory
+import tempfile   # work directory
+import itertools  # combinations of parameters
+import subprocess # launch each case in a new interpreter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mobidic_mpa
+from synthetic_vcf import SyntheticVCF, DEFAULT_TEMPLATE
+
+################################################################################
+#
+# CONSTANTS
+#
+################################################################################
+# Stages measured by mobidic_mpa.main
+STAGE_NAMES = ['read', 'check', 'score', 'write']
+
+# Columns of the report
+COLUMNS = ['records', 'samples', 'engine', 'threads', 'seconds', 'records_per_s', 'peak_rss_mb', 'workers_peak_rss_mb'] + [stage + '_s' for stage in STAGE_NAMES] + ['other_s']
+
+################################################################################
+#
+# FUNCTIONS
+#
+################################################################################
+def run_case(case):
+    """
+    @summary: Annotate one synthetic VCF with mobidic_mpa.main in the current process and measure it
+    @param case: [dict] The parameters of the case (input, output, stats, records, samples, engine, threads)
+    @return: [dict] The measures of the case (columns of the report)
+    """
+    log = logging.getLogger("MPA_benchmark")
+    log.setLevel(logging.WARNING)
+    args = argparse.Namespace(input=case['input'], output=case['output'], engine=case['engine'], threads=case['threads'], stats_json=case['stats'])
+    mobidic_mpa.main(args, log)
+    with open(case['stats']) as handle:
+        stats = json.load(handle)
+
+    measures = dict((key, case[key]) for key in ['samples', 'engine', 'threads'])
+    measures['records'] = stats['records']
+    measures['seconds'] = round(stats['seconds']['total'], 3)
+    measures['records_per_s'] = round(stats['records_per_s'], 1)
+    measures['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+    measures['workers_peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0, 1)
+    for stage in STAGE_NAMES:
+        measures[stage + '_s'] = round(stats['seconds'][stage], 3)
+    if case['threads'] <= 1:
+        measures['other_s'] = round(stats['seconds']['total'] - sum(stats['seconds'][stage] for stage in STAGE_NAMES), 3)
+    return measures
+
+def benchmark(args, log):
+    """
+    @summary: Generate the synthetic VCF and annotate them with each engine (one new interpreter by case)
+    @param args: [Namespace] The namespace extract from the script arguments.
+    @param log: [Logger] The logger of the script.
+    @return: [list] The measures of each case
+    """
+    work_directory = args.work_directory or tempfile.mkdtemp(prefix='mpa_benchmark_')
+    os.makedirs(work_directory, exist_ok=True)
+    results = []
+    try:
+        for nb_records, nb_samples in itertools.product(args.records, args.samples):
+            input_vcf = os.path.join(work_directory, 'synthetic_{}_{}.vcf.gz'.format(nb_records, nb_samples))
+            if not os.path.exists(input_vcf):
+                log.info("Generate " + input_vcf)
+                SyntheticVCF(args.template, seed=args.seed).write(input_vcf, nb_records, nb_samples)
+            for engine, threads in itertools.product(args.engines, args.threads):
+                case = {
+                    'input': input_vcf,
+                    'output': os.path.join(work_directory, 'annotated.vcf.gz' if args.compressed_output else 'annotated.vcf'),
+                    'stats': os.path.join(work_directory, 'stats.json'),
+                    'records': nb_records,
+                    'samples': nb_samples,
+                    'engine': engine,
+                    'threads': threads
+                }
+                for repeat in range(args.repeat):
+                    log.info("Run {} variants, {} samples, engine {}, {} threads".format(nb_records, nb_samples, engine, threads))
+                    process = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-case', json.dumps(case)],
+                        stdout=subprocess.PIPE, check=True, universal_newlines=True)
+                    results.append(json.loads(process.stdout.splitlines()[-1]))
+    finally:
+        if not args.work_directory:
+            shutil.rmtree(work_directory)
+    return results
+
+def write_report(results, handle):
+    """
+    @summary: Write the measures as a tabulated report
+    @param results: [list] The measures of each case
+    @param handle: [file] The output stream
+    @return: [None]
+    """
+    handle.write('\t'.join(COLUMNS) + '\n')
+    for measures in results:
+        handle.write('\t'.join(str(measures.get(column, '.')) for column in COLUMNS) + '\n')
+    return None
+
+################################################################################
+#
+# MAIN
+#
+################################################################################
+if __name__ == "__main__":
+    # Manage parameters
+    parser = argparse.ArgumentParser(description="Benchmark MPA on synthetic VCF annotated by ANNOVAR: records/s, peak RSS and time by stage.")
+    parser.add_argument('-t', '--template', default=DEFAULT_TEMPLATE, help='The annotated VCF used as template. [Default: %(default)s]')
+    parser.add_argument('-n', '--records', type=int, nargs='+', default=[10000], help='The numbers of variants (from 10000 to 10000000). [Default: %(default)s]')
+    parser.add_argument('-s', '--samples', type=int, nargs='+', default=[1], help='The numbers of samples (from 1 to 5000). [Default: %(default)s]')
+    parser.add_argument('-e', '--engines', nargs='+', default=['pyvcf', 'raw'], choices=['pyvcf', 'raw', 'numpy'], help='The engines of MPA. [Default: %(default)s]')
+    parser.add_argument('-p', '--threads', type=int, nargs='+', default=[1], help='The numbers of processes (with several processes, the time by stage is summed over the processes). [Default: %(default)s]')
+    parser.add_argument('-r', '--repeat', type=int, default=1, help='The number of runs of each case. [Default: %(default)s]')
+    parser.add_argument('-c', '--compressed-output', action='store_true', help='Write the annotated VCF compressed and indexed.')
+    parser.add_argument('-w', '--work-directory', help='The directory of the synthetic VCF, kept to be reused by next runs. [Default: temporary directory]')
+    parser.add_argument('--seed', type=int, default=1, help='The seed of the random generator. [Default: %(default)s]')
+    parser.add_argument('-o', '--output', help='The report (format: TSV). [Default: standard output]')
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        sys.exit(0)
+
+    logging.basicConfig(format='%(asctime)s - %(name)s [%(levelname)s] %(message)s')
+    log = logging.getLogger("MPA_benchmark")
+    log.setLevel(logging.INFO)
+    results = benchmark(args, log)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            write_report(results, handle)
+    else:
+        write_report(results, sys.stdout)
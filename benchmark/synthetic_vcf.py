@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+__author__ = 'Mobidic'
+__authors__ = ['Henri Pegeot','Kevin Yauy','Charles Van Goethem','David Baux']
+__copyright__ = 'Copyright (C) 2019'
+__license__ = 'Academic License Agreement'
+__version__ = '1.1.2'
+__email__ = 'h-pegeot@chu-montpellier.fr'
+__status__ = 'prod'
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import os         # os command
+import sys        # system command
+import re         # regex
+import random     # random values
+import argparse   # for options
+import logging    # logging messages
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mobidic_mpa
+from mobidic_mpa import bgzf
+
+################################################################################
+#
+# CONSTANTS
+#
+################################################################################
+# Template annotated by ANNOVAR shipped with MPA
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'testing_data_set.vcf')
+
+# Annotations renamed since the template was annotated
+RENAMED_KEYS = {'CLINSIG': 'CLNSIG'}
+
+# Header of the SpliceAI annotation (not available in the template)
+SPLICEAI_HEADER = '##INFO=<ID=spliceai_filtered,Number=.,Type=String,Description="spliceai_filtered annotation provided by ANNOVAR">'
+
+# Proportion of variants with a SpliceAI annotation and distribution of the delta scores
+SPLICEAI_RATE = 0.3
+SPLICEAI_SCORES = ['0.00'] * 12 + ['0.01', '0.02', '0.05', '0.12', '0.21', '0.35', '0.55', '0.81', '0.93']
+
+# Edge cases of the annotations added in the variants with --edge-rate
+EDGE_CASES = ['missing', 'duplicated', 'sv', 'insertion', 'deletion']
+
+# Values of the annotations not available
+MISSING_VALUES = ['.', 'NA', '', '.,D', 'NA,T']
+
+CONTIG_PATTERN = re.compile('^##contig=<ID=([^,>]+).*length=(\\d+)')
+
+################################################################################
+#
+# CLASS
+#
+################################################################################
+class SyntheticVCF(object):
+    """
+    @summary: Generator of VCF annotated by ANNOVAR with the header and the value distributions of a template.
+    """
+    def __init__(self, template=DEFAULT_TEMPLATE, mix=0.3, seed=None, edge_rate=0.0):
+        """
+        @param template: [str] Path of the annotated VCF used as template
+        @param mix: [float] Probability to replace each annotation read by MPA with a value drawn from all the template variants
+        @param seed: [int] Seed of the random generator
+        @param edge_rate: [float] Probability to add an edge case in each variant (see EDGE_CASES)
+        """
+        self.mix = mix
+        self.edge_rate = edge_rate
+        self.random = random.Random(seed)
+        self.header = []
+        self.contigs = []
+        self.records = []
+        self.distributions = dict((key, []) for key in mobidic_mpa.ANNOTATION_KEYS)
+        self.samples = []
+        self._read_template(template)
+
+    def _read_template(self, template):
+        """
+        @summary: Read the header, the variants and the sample values of the template
+        @param template: [str] Path of the template
+        @return: [None]
+        """
+        has_spliceai = False
+        with bgzf.open_input(template) as handle:
+            for line in handle:
+                line = line.rstrip('\r\n')
+                if line.startswith('##'):
+                    for old_key, new_key in RENAMED_KEYS.items():
+                        line = line.replace('##INFO=<ID=' + old_key + ',', '##INFO=<ID=' + new_key + ',')
+                    has_spliceai = has_spliceai or line.startswith('##INFO=<ID=spliceai_filtered,')
+                    match = CONTIG_PATTERN.match(line)
+                    if match:
+                        self.contigs.append((match.group(1), int(match.group(2))))
+                    self.header.append(line)
+                elif line.startswith('#'):
+                    if not has_spliceai:
+                        self.header.append(SPLICEAI_HEADER)
+                    self.header.append('\t'.join(line.split('\t')[:9]))
+                elif line:
+                    self._add_record(line.split('\t'), has_spliceai)
+        if not self.contigs:
+            self.contigs = [(record[0], 250000000) for record in self.records[:1]]
+        if not self.samples:
+            self.samples = ['./.']
+
+    def _add_record(self, columns, has_spliceai):
+        """
+        @summary: Store a variant of the template with the slots of the annotations read by MPA
+        @param columns: [list] The columns of the variant
+        @param has_spliceai: [bool] True if the template is annotated with SpliceAI
+        @return: [None]
+        """
+        entries = []
+        slots = dict()
+        for entry in columns[7].split(';'):
+            key, sep, value = entry.partition('=')
+            key = RENAMED_KEYS.get(key, key)
+            if not has_spliceai and key == 'dbscSNV_ADA_SCORE':
+                slots['spliceai_filtered'] = len(entries)
+                entries.append('spliceai_filtered=.')
+            if key in self.distributions:
+                slots[key] = len(entries)
+                self.distributions[key].append(value)
+            entries.append(key + sep + value)
+        if not has_spliceai and 'spliceai_filtered' not in slots:
+            slots['spliceai_filtered'] = len(entries)
+            entries.append('spliceai_filtered=.')
+        self.records.append((columns[2], columns[3], columns[4].split(',')[0], columns[5], columns[6], entries, slots, columns[8] if len(columns) > 8 else 'GT'))
+        self.samples.extend(sample for sample in columns[9:] if not sample.startswith('./.'))
+
+    def spliceai(self, alt):
+        """
+        @summary: Returns a synthetic SpliceAI annotation (escaped as by ANNOVAR)
+        @param alt: [str] The alternative allele
+        @return: [str] The annotation or "." for most of the variants
+        """
+        if self.random.random() >= SPLICEAI_RATE:
+            return '.'
+        scores = [self.random.choice(SPLICEAI_SCORES) for _ in range(4)]
+        return ('ALLELE\\x3d{}\\x3bSYMBOL\\x3dGENE\\x3bDS_AG\\x3d{}\\x3bDS_AL\\x3d{}\\x3bDS_DG\\x3d{}\\x3bDS_DL\\x3d{}'
+            '\\x3bDP_AG\\x3d-2\\x3bDP_AL\\x3d4\\x3bDP_DG\\x3d-30\\x3bDP_DL\\x3d2').format(alt, *scores)
+
+    def edge_case(self, position, ref, alt, entries, slots):
+        """
+        @summary: Returns a variant with an edge case: an annotation not available (".", "NA", empty or missing first
+        value), an annotation defined twice, a structural variant, an insertion or a deletion
+        @param position: [int] The position of the variant
+        @param ref: [str] The reference allele
+        @param alt: [str] The alternative allele
+        @param entries: [list] The INFO entries of the variant
+        @param slots: [dict] The position of each annotation read by MPA in entries
+        @return: [tuple] The reference allele, the alternative allele and the INFO entries
+        """
+        case = self.random.choice(EDGE_CASES)
+        key = self.random.choice(sorted(self.distributions))
+        if case == 'missing':
+            entries[slots[key]] = key + '=' + self.random.choice(MISSING_VALUES)
+        elif case == 'duplicated':
+            entries.append(key + '=' + self.random.choice(self.distributions[key] or ['.']))
+        elif case == 'sv':
+            alt = self.random.choice(['<DEL>', '<DUP>', '<INV>'])
+            entries = entries + ['SVTYPE=' + alt[1:-1], 'END=' + str(position + self.random.randint(50, 5000))]
+        elif case == 'insertion':
+            ref = ref[0]
+            alt = ref + ''.join(self.random.choice('ACGT') for _ in range(self.random.randint(1, 6)))
+        else:
+            ref = ref[0] + ''.join(self.random.choice('ACGT') for _ in range(self.random.randint(1, 6)))
+            alt = ref[0]
+        return ref, alt, entries
+
+    def positions(self, nb_records):
+        """
+        @summary: Returns sorted positions on the contigs (number of variants proportional to the contig length)
+        @param nb_records: [int] The number of variants
+        @return: [generator] The tuples (chromosome, position)
+        """
+        total_length = sum(length for name, length in self.contigs)
+        remaining = nb_records
+        for rank, (name, length) in enumerate(self.contigs):
+            if rank == len(self.contigs) - 1:
+                count = remaining
+            else:
+                count = min(remaining, nb_records * length // total_length)
+            remaining -= count
+            for position in sorted(self.random.sample(range(1, length + 1), min(count, length))):
+                yield name, position
+
+    def write(self, filename, nb_records, nb_samples=1):
+        """
+        @summary: Write a synthetic VCF (BGZF compressed when the name ends with ".gz")
+        @param filename: [str] Path of the VCF
+        @param nb_records: [int] The number of variants
+        @param nb_samples: [int] The number of samples
+        @return: [int] The number of variants written
+        """
+        choice = self.random.choice
+        nb_written = 0
+        handle = bgzf.open_output(filename, None)
+        try:
+            handle.write('\n'.join(self.header[:-1]) + '\n')
+            handle.write('\t'.join([self.header[-1]] + ['sample' + str(rank + 1) for rank in range(nb_samples)]) + '\n')
+            for chrom, position in self.positions(nb_records):
+                record_id, ref, alt, qual, record_filter, entries, slots, record_format = choice(self.records)
+                entries = list(entries)
+                for key, slot in slots.items():
+                    if key == 'spliceai_filtered':
+                        entries[slot] = 'spliceai_filtered=' + self.spliceai(alt)
+                    elif self.random.random() < self.mix:
+                        entries[slot] = key + '=' + choice(self.distributions[key])
+                if self.edge_rate and self.random.random() < self.edge_rate:
+                    ref, alt, entries = self.edge_case(position, ref, alt, entries, slots)
+                samples = self.random.choices(self.samples, k=nb_samples)
+                handle.write('\t'.join([chrom, str(position), record_id, ref, alt, qual, record_filter, ';'.join(entries), record_format] + samples) + '\n')
+                nb_written += 1
+        finally:
+            handle.close()
+        return nb_written
+
+################################################################################
+#
+# MAIN
+#
+################################################################################
+if __name__ == "__main__":
+    # Manage parameters
+    parser = argparse.ArgumentParser(description="Generate a synthetic VCF annotated by ANNOVAR from the header and the value distributions of a template.")
+    parser.add_argument('-t', '--template', default=DEFAULT_TEMPLATE, help='The annotated VCF used as template. [Default: %(default)s]')
+    parser.add_argument('-n', '--records', type=int, default=10000, help='The number of variants. [Default: %(default)s]')
+    parser.add_argument('-s', '--samples', type=int, default=1, help='The number of samples. [Default: %(default)s]')
+    parser.add_argument('-m', '--mix', type=float, default=0.3, help='The probability to replace each annotation read by MPA with a value drawn from all the template variants. [Default: %(default)s]')
+    parser.add_argument('--edge-rate', type=float, default=0.0, help='The probability to add an edge case in each variant: annotation not available or defined twice, structural variant, insertion or deletion. [Default: %(default)s]')
+    parser.add_argument('--seed', type=int, default=1, help='The seed of the random generator. [Default: %(default)s]')
+    parser.add_argument('-o', '--output', required=True, help='The synthetic VCF (format: VCF or VCF.GZ).')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s [%(levelname)s] %(message)s')
+    log = logging.getLogger("MPA_synthetic_vcf")
+    log.setLevel(logging.INFO)
+    generator = SyntheticVCF(args.template, args.mix, args.seed, args.edge_rate)
+    nb_records = generator.write(args.output, args.records, args.samples)
+    log.info("{} variants with {} samples written in {}".format(nb_records, args.samples, args.output))
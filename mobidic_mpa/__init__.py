@@ -23,8 +23,82 @@ import re         # regex
 import argparse   # for options
 import logging    # logging messages
 import subprocess # launch subprocess
+import time       # timers
+import functools  # cache of classifications
+import json       # trace of the decisions
+import math       # finite scores
 import collections
 
+from mobidic_mpa import bgzf   # compressed VCF
+from mobidic_mpa import rawvcf # raw-text VCF engine
+from mobidic_mpa import regions # regions of indexed VCF
+from mobidic_mpa import columnar # vectorized scoring
+from mobidic_mpa import stats as mpa_stats # time by stage
+from mobidic_mpa import scorecache # scores of the previous runs
+from mobidic_mpa.scorer import Scorer, MPAResult # in-memory scoring API
+from mobidic_mpa import selection # selection of the annotated records
+from mobidic_mpa import table # columnar export of the MPA values
+
+########################################################################
+#
+# CONSTANTS
+#
+########################################################################
+# INFO keys read by MPA (17 are mandatory see full documentation)
+ANNOTATION_KEYS = [
+    'Func.refGene',
+    'ExonicFunc.refGene',
+    'FATHMM_pred',
+    'dbscSNV_ADA_SCORE',
+    'dbscSNV_RF_SCORE',
+    'spliceai_filtered',
+    'SIFT_pred',
+    'Polyphen2_HDIV_pred',
+    'Polyphen2_HVAR_pred',
+    'LRT_pred',
+    'MutationTaster_pred',
+    'FATHMM_pred',
+    'PROVEAN_pred',
+    'fathmm-MKL_coding_pred',
+    'MetaSVM_pred',
+    'MetaLR_pred',
+    'CLNSIG'
+]
+
+# INFO key of each annotation read by MPA (pairs of ANNOTATION_KEYS and INFO keys, None for an annotation not available)
+DEFAULT_SCHEMA = tuple((key, key) for key in ANNOTATION_KEYS)
+
+# INFO key given in a schema for an annotation not available in the VCF
+NOT_AVAILABLE = '.'
+
+# Maximum number of distinct values of Func.refGene, ExonicFunc.refGene and CLNSIG kept with their classification
+CLASSIFICATION_CACHE_SIZE = 4096
+
+# Maximum number of distinct annotations of variants kept with their MPA values
+SCORE_MEMO_SIZE = 65536
+
+# Classification of an ExonicFunc.refGene value (ranks or False)
+ExonicFuncImpacts = collections.namedtuple('ExonicFuncImpacts', ['stop', 'frameshift', 'missense', 'unknown'])
+
+# Classification of a Func.refGene value
+FuncImpacts = collections.namedtuple('FuncImpacts', ['exonic', 'splicing'])
+
+# Delta scores of the SpliceAI annotation (acceptor gain/loss, donor gain/loss)
+SPLICEAI_KEYS = ['DS_AG', 'DS_AL', 'DS_DG', 'DS_DL']
+
+# Decoded SpliceAI annotation
+SpliceAIScores = collections.namedtuple('SpliceAIScores', SPLICEAI_KEYS + ['max'])
+
+# INFO keys added by MPA (in header order)
+MPA_KEYS = [
+    'MPA_adjusted',
+    'MPA_available',
+    'MPA_deleterious',
+    'MPA_final_score',
+    'MPA_impact',
+    'MPA_ranking'
+]
+
 ########################################################################
 #
 # FUNCTIONS
@@ -58,33 +132,74 @@ def wich(software):
             soft_path = eval_path
     return soft_path
 
-def check_annotation(vcf_infos):
+def read_schema(filename):
+    """
+    @summary: Read the INFO keys of the annotations in a schema file (one "annotation<TAB>INFO key" or "annotation=INFO key"
+    by line, lines starting with "#" are ignored ; the INFO key "." marks an annotation not available in the VCF)
+    @param filename: [str] Path of the schema
+    @return: [dict] The INFO key by annotation
+    """
+    mapping = dict()
+    with open(filename) as handle:
+        for line_number, line in enumerate(handle, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            columns = line.split('\t') if '\t' in line else line.split('=', 1)
+            if len(columns) != 2:
+                raise ValueError("Line {} of the schema {} must contain an annotation and an INFO key: {}".format(line_number, filename, line))
+            mapping[columns[0].strip()] = columns[1].strip()
+    return mapping
+
+def compile_schema(mapping=None):
+    """
+    @summary: Returns the INFO key of each annotation read by MPA (the annotations not in mapping keep their name)
+    @param mapping: [dict] The INFO key by annotation (from ANNOTATION_KEYS) ; "." for an annotation not available in the VCF
+    @return: [tuple] The pairs (annotation, INFO key or None) in the order of ANNOTATION_KEYS
+    """
+    if not mapping:
+        return DEFAULT_SCHEMA
+    unknown = sorted(set(mapping) - set(ANNOTATION_KEYS))
+    if unknown:
+        raise ValueError("Unknown annotations in schema: " + ", ".join(unknown) + " (expected: " + ", ".join(sorted(set(ANNOTATION_KEYS))) + ")")
+    schema = []
+    for key in ANNOTATION_KEYS:
+        info_key = mapping.get(key, key)
+        schema.append((key, None if info_key == NOT_AVAILABLE else info_key))
+    return tuple(schema)
+
+def args_schema(args):
+    """
+    @summary: Returns the schema given by the options --schema and --annotation-key (the keys of --annotation-key override the file)
+    @param args: [Namespace] The namespace extract from the script arguments (schema, annotation_key)
+    @return: [tuple] The schema returned by compile_schema
+    """
+    mapping = dict()
+    if getattr(args, 'schema', None):
+        mapping.update(read_schema(args.schema))
+    for entry in getattr(args, 'annotation_key', None) or []:
+        key, sep, info_key = entry.partition('=')
+        if not sep:
+            raise ValueError("Annotation keys must be given as ANNOTATION=INFO: " + entry)
+        mapping[key] = info_key
+    return compile_schema(mapping)
+
+def schema_info_keys(schema=None):
+    """
+    @summary: Returns the INFO keys read by MPA
+    @param schema: [tuple] The schema returned by compile_schema (None for the names of ANNOTATION_KEYS)
+    @return: [list] The INFO keys (without the annotations not available)
+    """
+    return [info_key for key, info_key in (schema or DEFAULT_SCHEMA) if info_key is not None]
+
+def check_annotation(vcf_infos, schema=None):
     """
     @summary: Chek if vcf followed the guidelines for annotations (17 are mandatory see full documentation)
     @param vcf_infos: [vcf.reader.infos] One record of the VCF
+    @param schema: [tuple] The INFO key of each annotation returned by compile_schema (None for the names of ANNOTATION_KEYS)
     @return: [None]
     """
-    vcf_keys = [
-        'Func.refGene',
-    	'ExonicFunc.refGene',
-    	'FATHMM_pred',
-    	'dbscSNV_ADA_SCORE',
-    	'dbscSNV_RF_SCORE',
-        'spliceai_filtered',
-        'SIFT_pred',
-    	'Polyphen2_HDIV_pred',
-    	'Polyphen2_HVAR_pred',
-    	'LRT_pred',
-    	'MutationTaster_pred',
-    	'FATHMM_pred',
-    	'PROVEAN_pred',
-    	'fathmm-MKL_coding_pred',
-    	'MetaSVM_pred',
-    	'MetaLR_pred',
-    	'CLNSIG'
-    ]
-
-    if(not set(vcf_keys).issubset(vcf_infos)):
+    if(not set(schema_info_keys(schema)).issubset(vcf_infos)):
         sys.exit('VCF not correctly annotated. See documentation and provide a well annotated vcf (annotation with annovar).')
 
     return None
@@ -113,8 +228,6 @@ def calculate_adjusted_score(scores_impact):
     available = 0
     score_adjusted = 0
 
-    log.debug("scores impact : " + str(scores_impact))
-
     for score, impact in scores_impact.items():
         if(impact == "D" or impact == "A"):
             deleterious += 1
@@ -125,13 +238,6 @@ def calculate_adjusted_score(scores_impact):
     if available > 0:
         score_adjusted = float(deleterious)/float(available) * 10
 
-
-    log.debug(">> Return: ")
-    log.debug({
-        "adjusted":score_adjusted,
-        "available":available,
-        "deleterious":deleterious
-    })
 	# Return meta score and available tools
     return {
         "adjusted":score_adjusted,
@@ -146,30 +252,19 @@ def is_clinvar_pathogenic(clinsig):
     @param clinsig: [str] The clinvar annotation provided by the vcf
     @return: [int/bool] Rank (1) if is pathogenic and no Benign; False in other cases
     """
-    # possible clinsig
-    clinsig_possible = {
-        "Benign": 0,
-        "Benign/Likely_benign": 1,
-        "Likely_benign": 2,
-        "Uncertain_significance": 3,
-        "Likely_pathogenic": 4,
-        "Pathogenic/Likely_pathogenic": 5,
-        "Pathogenic": 6,
-        "other": None,
-        "Affects": None,
-        "drug_response": None,
-        "confers_sensitivity": None,
-        "risk_factor": None,
-        "association": None,
-        "association_not_found": None,
-        "protective": None,
-        "not_provided": None,
-        "conflicting_data_from_submitters": None,
-    }
     # No clinsig available
     if clinsig == None:
         return False
 
+    return classify_clinsig(clinsig)
+
+@functools.lru_cache(maxsize=CLASSIFICATION_CACHE_SIZE)
+def classify_clinsig(clinsig):
+    """
+    @summary: Classify a clinvar annotation (computed once by distinct value)
+    @param clinsig: [str] The clinvar annotation provided by the vcf
+    @return: [int/bool] Rank (1) if is pathogenic and no Benign; False in other cases
+    """
     # Test if "Pathogenic" or "Benign" match on clinsig
     match_pathogenic = re.search("pathogenic", clinsig, re.IGNORECASE)
     match_benign = re.search("benign", clinsig, re.IGNORECASE)
@@ -182,12 +277,42 @@ def is_clinvar_pathogenic(clinsig):
         return False
 
 
+def parse_spliceai(spliceai):
+    """
+    @summary: Decode the delta scores of a SpliceAI annotation (escaped as "KEY\\x3dVALUE\\x3b..." by ANNOVAR)
+    @param spliceai: [str] The spliceai_filtered annotation provided by the vcf
+    @return: [SpliceAIScores] The four delta scores (NaN if missing after a score greater than 0.8) and their maximum
+    """
+    spliceAI_annot = dict()
+    for annot in spliceai.split("\\x3b"):
+        if annot.startswith("DS_"):
+            key, sep, value = annot.partition("\\x3d")
+            if sep:
+                spliceAI_annot[key] = value.partition("\\x3d")[0]
+
+    # Maximum as the comparison of each score to a threshold (NaN is never greater)
+    scores = []
+    maximum = float('-inf')
+    for key in SPLICEAI_KEYS:
+        try:
+            score = float(spliceAI_annot[key])
+        except (KeyError, ValueError):
+            # The thresholds stop at the first score greater than 0.8: the next scores are not required
+            if maximum > 0.8:
+                score = float('nan')
+            else:
+                raise
+        scores.append(score)
+        if score > maximum:
+            maximum = score
+    return SpliceAIScores(scores[0], scores[1], scores[2], scores[3], maximum)
+
 def is_splice_impact(splices_scores, is_indel, funcRefGene):
     """
     @summary: Predict splicing effect of the variant
     @param splices_scores: [dict] The dictionnary of splicing scores
     @param is_indel: [bool] Boolean to define if variants is indel or not
-    @param funcRefGene: [str] Annotation provided by refGene about the biological function
+    @param funcRefGene: [str/None] Annotation provided by refGene about the biological function (None if not available)
     @return: [int/bool] Rank (3,4,5,6,7 or 8) if is splicing impact; False in other cases
     """
 
@@ -202,34 +327,15 @@ def is_splice_impact(splices_scores, is_indel, funcRefGene):
     )
 
     # If Zscore predict splicing impact but no ADA and RF annotation
+    spliceAI_max = None
     if(splices_scores["spliceAI"] != None):
-        spliceAI_split = splices_scores["spliceAI"].split("\\x3b")
-        spliceAI_annot = dict()
-        for annot in spliceAI_split:
-            annot_split = annot.split("\\x3d")
-            if len(annot_split) > 1:
-                spliceAI_annot[annot_split[0]] = annot_split[1]
-    spliceAI_score_high = (splices_scores["spliceAI"] != None and
-        (float(spliceAI_annot["DS_AG"]) > 0.8 or
-        float(spliceAI_annot["DS_AL"]) > 0.8 or
-        float(spliceAI_annot["DS_DG"]) > 0.8 or
-        float(spliceAI_annot["DS_DL"]) > 0.8 )
-    )
-    spliceAI_score_moderate = (splices_scores["spliceAI"] != None and
-        (float(spliceAI_annot["DS_AG"]) > 0.5 or
-        float(spliceAI_annot["DS_AL"]) > 0.5 or
-        float(spliceAI_annot["DS_DG"]) > 0.5 or
-        float(spliceAI_annot["DS_DL"]) > 0.5 )
-    )
-    spliceAI_score_low = (splices_scores["spliceAI"] != None and
-        (float(spliceAI_annot["DS_AG"]) > 0.2 or
-        float(spliceAI_annot["DS_AL"]) > 0.2 or
-        float(spliceAI_annot["DS_DG"]) > 0.2 or
-        float(spliceAI_annot["DS_DL"]) > 0.2 )
-    )
+        spliceAI_max = parse_spliceai(splices_scores["spliceAI"]).max
+    spliceAI_score_high = (spliceAI_max != None and spliceAI_max > 0.8)
+    spliceAI_score_moderate = (spliceAI_max != None and spliceAI_max > 0.5)
+    spliceAI_score_low = (spliceAI_max != None and spliceAI_max > 0.2)
 
     # Home made prediction of splice impact
-    match_splicing = re.search("splicing", funcRefGene, re.IGNORECASE)
+    match_splicing = classify_func(funcRefGene).splicing
     home_splice = (is_indel and match_splicing)
 
     # Determine if there is a splicing impact
@@ -248,19 +354,48 @@ def is_splice_impact(splices_scores, is_indel, funcRefGene):
     else:
         return False
 
-def is_stop_impact(exonicFuncRefGene):
+@functools.lru_cache(maxsize=CLASSIFICATION_CACHE_SIZE)
+def classify_func(funcRefGene):
     """
-    @summary: Predict stop codon effect of the variant
+    @summary: Classify the biological function of the variant (computed once by distinct value)
+    @param funcRefGene: [str/None] Annotation provided by refGene about the biological function (None if not available)
+    @return: [FuncImpacts] True if the function is exonic and if it is splicing (neither when not available)
+    """
+    if funcRefGene is None:
+        return FuncImpacts(exonic=False, splicing=False)
+    return FuncImpacts(
+        exonic=re.search("exonic", funcRefGene, re.IGNORECASE) is not None,
+        splicing=re.search("splicing", funcRefGene, re.IGNORECASE) is not None
+    )
+
+@functools.lru_cache(maxsize=CLASSIFICATION_CACHE_SIZE)
+def classify_exonic_func(exonicFuncRefGene):
+    """
+    @summary: Classify the exonic function of the variant (computed once by distinct value)
     @param exonicFuncRefGene: [str] The exonic function predicted by RefGene
-    @return: [bool] Rank (2) if is stop impact; False in other cases
+    @return: [ExonicFuncImpacts] The stop, frameshift and unknown ranks (or False) and True if the variant is missense
     """
     match_stoploss = re.search("stoploss", exonicFuncRefGene, re.IGNORECASE)
     match_stopgain = re.search("stopgain", exonicFuncRefGene, re.IGNORECASE)
+    match_frameshift = re.search("frameshift", exonicFuncRefGene, re.IGNORECASE)
+    match_nonframeshift = re.search("nonframeshift", exonicFuncRefGene, re.IGNORECASE)
+    match_missense = re.search("nonsynonymous_SNV", exonicFuncRefGene, re.IGNORECASE)
+    match_unknown = re.search("unknown", exonicFuncRefGene, re.IGNORECASE)
 
-    if(match_stopgain or match_stoploss):
-        return 2
-    else:
-        return False
+    return ExonicFuncImpacts(
+        stop=2 if (match_stopgain or match_stoploss) else False,
+        frameshift=2 if (match_frameshift and not match_nonframeshift) else False,
+        missense=match_missense is not None,
+        unknown=10 if match_unknown else False
+    )
+
+def is_stop_impact(exonicFuncRefGene):
+    """
+    @summary: Predict stop codon effect of the variant
+    @param exonicFuncRefGene: [str] The exonic function predicted by RefGene
+    @return: [bool] Rank (2) if is stop impact; False in other cases
+    """
+    return classify_exonic_func(exonicFuncRefGene).stop
 
 def is_frameshift_impact(exonicFuncRefGene):
     """
@@ -268,13 +403,7 @@ def is_frameshift_impact(exonicFuncRefGene):
     @param exonicFuncRefGene: [str] The exonic function predicted by RefGene
     @return: [int/bool] Rank (2) if is frameshift impact; False in other cases
     """
-    match_frameshift = re.search("frameshift", exonicFuncRefGene, re.IGNORECASE)
-    match_nonframeshift = re.search("nonframeshift", exonicFuncRefGene, re.IGNORECASE)
-
-    if(match_frameshift and not match_nonframeshift):
-        return 2
-    else:
-        return False
+    return classify_exonic_func(exonicFuncRefGene).frameshift
 
 def is_missense_impact(exonicFuncRefGene, adjusted_score):
     """
@@ -282,9 +411,7 @@ def is_missense_impact(exonicFuncRefGene, adjusted_score):
     @param exonicFuncRefGene: [str] The exonic function predicted by RefGene
     @return: [int/bool] Rank () if is missense impact; False in other cases
     """
-    match_missense = re.search("nonsynonymous_SNV", exonicFuncRefGene, re.IGNORECASE)
-
-    if(match_missense):
+    if(classify_exonic_func(exonicFuncRefGene).missense):
         if(adjusted_score > 6):
             return 5
         elif(adjusted_score > 2):
@@ -300,151 +427,480 @@ def is_unknown_impact(exonicFuncRefGene):
     @param exonicFuncRefGene: [str] The exonic function predicted by RefGene
     @return: [int/bool] Rank (10) if is unknown impact; False in other cases
     """
-    match_unknown = re.search("unknown", exonicFuncRefGene, re.IGNORECASE)
+    return classify_exonic_func(exonicFuncRefGene).unknown
+
+def score_annotations(annotations, is_indel, trace=None):
+    """
+    @summary: Compute the MPA scores of one variant from its annotations
+    @param annotations: [dict] The first value of each annotation listed in ANNOTATION_KEYS (None if not available)
+    @param is_indel: [bool] Boolean to define if variants is indel or not
+    @param trace: [dict] Filled with the decisions of the ranking (predictors, splicing and meta impacts) ; None to not trace
+    @return: [dict] The MPA values (keys from MPA_KEYS) to add in the INFO of the variant
+    """
+    # Deleterious impact scores
+    impacts_scores = {
+        "SIFT" : annotations['SIFT_pred'],
+        "HDIV" : annotations['Polyphen2_HDIV_pred'],
+        "HVAR" : annotations['Polyphen2_HVAR_pred'],
+        "LRT" : annotations['LRT_pred'],
+        "MutationTaster" : annotations['MutationTaster_pred'],
+        "FATHMM" : annotations['FATHMM_pred'],
+        "PROVEAN" : annotations['PROVEAN_pred'],
+        "MKL" : annotations['fathmm-MKL_coding_pred'],
+        "SVM" : annotations['MetaSVM_pred'],
+        "LR" : annotations['MetaLR_pred']
+    }
+
+    # Splicing impact scores
+    splices_scores = {
+        "ADA": annotations['dbscSNV_ADA_SCORE'],
+        "RF": annotations['dbscSNV_RF_SCORE'],
+        "spliceAI": annotations['spliceai_filtered'],
+    }
+
+    # MPA aggregate the information to predict some effects
+    meta_impact = {
+        "clinvar_pathogenicity": False,
+        "stop_impact": False,
+        "splice_impact": False,
+        "frameshift_impact": False,
+        "unknown_impact": False
+    }
+
+    # Calculate adjusted score for each variants
+    adjusted_score = calculate_adjusted_score(impacts_scores)
+
+    # Determine if variant is well annotated with clinvar as deleterious
+    meta_impact["clinvar_pathogenicity"] = is_clinvar_pathogenic(annotations['CLNSIG'])
+
+    # Determine the impact on splicing
+    meta_impact["splice_impact"] = is_splice_impact(splices_scores, is_indel, annotations['Func.refGene'])
+
+    # Determine the exonic impact
+    match_exonic = classify_func(annotations['Func.refGene']).exonic
+    if(match_exonic and annotations['ExonicFunc.refGene'] != None):
+        # Determine the stop impact
+        meta_impact["stop_impact"] = is_stop_impact(annotations['ExonicFunc.refGene'])
+
+        # Determine the frameshift impact
+        meta_impact["frameshift_impact"] = is_frameshift_impact(annotations['ExonicFunc.refGene'])
+
+        # Determine the missense impact
+        meta_impact["missense_impact"] = is_missense_impact(annotations['ExonicFunc.refGene'], adjusted_score["adjusted"])
+
+        # Determine if unknown impact (misunderstand gene)
+        # NOTE: /!\ Be careful to updates regularly your databases /!\
+        meta_impact["unknown_impact"] = is_unknown_impact(annotations['ExonicFunc.refGene'])
+
+    # Ranking of variants
+    rank = False
+    mpa_impact = ""
+    for impact in meta_impact:
+        if (meta_impact[impact]):
+            mpa_impact = mpa_impact + impact + ","
+            if(meta_impact[impact]<rank or not rank):
+                rank = meta_impact[impact]
+                if(impact == "unknown_impact" or impact == "missense_impact"):
+                    adjusted_score["final_score"] = adjusted_score["adjusted"]
+                elif(impact == "splice_impact" and meta_impact["splice_impact"] == 6):
+                    adjusted_score["final_score"] = 6
+                elif(impact == "splice_impact" and meta_impact["splice_impact"] == 8):
+                    adjusted_score["final_score"] = 2
+                else:
+                    adjusted_score["final_score"] = 10
+
+    # if not ranking default value 10
+    if not rank:
+        rank = 10
+        mpa_impact = "NULL,"
+        adjusted_score["final_score"] = adjusted_score["adjusted"]
+
+    mpa_scores = {
+        'MPA_impact': mpa_impact[:-1],
+        'MPA_ranking': rank
+    }
+    for sc in adjusted_score:
+        mpa_scores['MPA_' + sc] = adjusted_score[sc]
+
+    # Decisions of the ranking (only when the variants are traced)
+    if trace is not None:
+        spliceAI_max = None
+        if annotations['spliceai_filtered'] != None:
+            spliceAI_max = parse_spliceai(annotations['spliceai_filtered']).max
+        trace['predictors'] = impacts_scores
+        trace['splicing'] = {
+            "ADA": splices_scores["ADA"],
+            "RF": splices_scores["RF"],
+            "spliceAI_max": spliceAI_max if spliceAI_max != None and math.isfinite(spliceAI_max) else None
+        }
+        trace['meta_impact'] = dict((impact, meta_impact[impact]) for impact in meta_impact if meta_impact[impact])
+    return mpa_scores
+
+def annotation_signature(annotations):
+    """
+    @summary: Returns the values used to score a variant (variants with the same signature have the same MPA values)
+    @param annotations: [dict] The first value of each annotation listed in ANNOTATION_KEYS (None if not available)
+    @return: [tuple] The values of ANNOTATION_KEYS
+    """
+    return tuple(annotations[key] for key in ANNOTATION_KEYS)
+
+@functools.lru_cache(maxsize=SCORE_MEMO_SIZE)
+def score_signature(signature, is_indel):
+    """
+    @summary: Compute the MPA scores of the variants with these annotations (computed once by distinct signature)
+    @param signature: [tuple] The values of ANNOTATION_KEYS returned by annotation_signature
+    @param is_indel: [bool] Boolean to define if variants is indel or not
+    @return: [dict] The MPA values (keys from MPA_KEYS) ; shared by the variants, it must not be modified
+    """
+    return score_annotations(dict(zip(ANNOTATION_KEYS, signature)), is_indel)
 
-    if(match_unknown):
-        return 10
+def count_memo(stats, memo_info):
+    """
+    @summary: Add the hits and the misses of score_signature since memo_info to the counters of the annotation
+    @param stats: [PipelineStats] The time by stage and the counters of the annotation
+    @param memo_info: [CacheInfo] The cache_info() of score_signature before the scoring
+    @return: [None]
+    """
+    current = score_signature.cache_info()
+    stats.count('memo_hits', current.hits - memo_info.hits)
+    stats.count('memo_misses', current.misses - memo_info.misses)
+    return None
+
+def format_trace(chrom, pos, ref, alt, is_indel=None, mpa_scores=None, trace=None, error=None):
+    """
+    @summary: Returns the trace of one variant (one compact JSON line)
+    @param chrom: [str] The chromosome
+    @param pos: [int] The position
+    @param ref: [str] The reference allele
+    @param alt: [str] The alternative alleles
+    @param is_indel: [bool] Boolean to define if variants is indel or not
+    @param mpa_scores: [dict] The MPA values returned by score_annotations (None if the variant is skipped)
+    @param trace: [dict] The decisions filled by score_annotations
+    @param error: [str] The reason why the variant is skipped
+    @return: [str] The JSON line (with end of line)
+    """
+    decisions = {"CHROM": chrom, "POS": int(pos), "REF": ref, "ALT": alt}
+    if error is not None:
+        decisions["skipped"] = error
     else:
-        return False
+        decisions["is_indel"] = bool(is_indel)
+        decisions.update(trace)
+        decisions.update(mpa_scores)
+    return json.dumps(decisions, separators=(',', ':')) + "\n"
+
+def add_mpa_infos(vcf_reader):
+    """
+    @summary: Declare the INFO added by MPA in the header of the VCF
+    @param vcf_reader: [vcf.Reader] The reader of the VCF to annotate
+    @return: [None]
+    """
+    # TODO: improve this ! already existing on pyVCF
+    _Info = collections.namedtuple('Info', ['id', 'num', 'type', 'desc', 'source', 'version'])
+    info_MPA_adjusted = _Info("MPA_adjusted", ".", "String", "MPA_adjusted : normalize MPA missense score from 0 to 10", "MPA", "1.1.0")
+    info_MPA_available = _Info("MPA_available", ".", "String", "MPA_available : number of missense tools annotation available for this variant", "MPA", "1.1.0")
+    info_MPA_deleterious = _Info("MPA_deleterious", ".", "String", "MPA_deleterious : number of missense tools that annotate this variant pathogenic", "MPA", "1.1.0")
+    info_MPA_final_score = _Info("MPA_final_score", ".", "String", "MPA_final_score : unique score that take into account curated database, biological assumptions, splicing predictions and the sum of various predictors for missense alterations. Annotations are made for exonic and splicing variants up to +300nt.", "MPA", "1.1.0")
+    info_MPA_impact = _Info("MPA_impact", ".", "String", "MPA_impact : pathogenic predictions (clinvar_pathogenicity, splice_impact, stop and frameshift_impact)", "MPA", "1.1.0")
+    info_MPA_ranking = _Info("MPA_ranking", ".", "String", "MPA_ranking : prioritize variants with ranks from 1 to 10", "MPA", "1.1.0")
+
+    # TODO: improve this
+    vcf_reader.infos.update({'MPA_adjusted':info_MPA_adjusted})
+    vcf_reader.infos.update({'MPA_available':info_MPA_available})
+    vcf_reader.infos.update({'MPA_deleterious':info_MPA_deleterious})
+    vcf_reader.infos.update({'MPA_final_score':info_MPA_final_score})
+    vcf_reader.infos.update({'MPA_impact':info_MPA_impact})
+    vcf_reader.infos.update({'MPA_ranking':info_MPA_ranking})
+
+    return None
+
+def close_output(vcf_writer):
+    """
+    @summary: Close the annotated VCF (write the selected variants, and its index if the output is compressed)
+    @param vcf_writer: [vcf.Writer] The writer of the annotated VCF
+    @return: [None]
+    """
+    # Closed directly: vcf.Writer.close ignores the AttributeError raised while the selected variants are written
+    vcf_writer.stream.close()
+    index = getattr(vcf_writer.stream, 'index', None)
+    if index is not None:
+        if index.is_sorted:
+            log.info("Index written in " + index.filename)
+        else:
+            log.warning("Variants are not sorted: no index written for " + vcf_writer.stream.name)
+    return None
+
+def record_alt(record):
+    """
+    @summary: Returns the ALT column of a PyVCF record as in the VCF
+    @param record: [vcf.model._Record] The record
+    @return: [str] The alternative alleles separated by comma
+    """
+    return ",".join("." if alt is None else str(alt) for alt in record.ALT)
+
+def annotate_records(vcf_reader, vcf_writer, stats, trace_stream=None, cache=None, max_rank=None, rejected_stream=None, schema=None):
+    """
+    @summary: Annotate the variants with MPA score from the PyVCF records.
+    @param vcf_reader: [vcf.Reader] The reader of the VCF (header already parsed, MPA INFO already declared)
+    @param vcf_writer: [vcf.Writer] The writer of the annotated VCF (header already written)
+    @param stats: [PipelineStats] The time by stage and the counters of the annotation
+    @param trace_stream: [file] The stream of the decisions of each variant (None to not trace)
+    @param cache: [ScoreCache] The MPA values of the variants scored by the previous runs (None to score each variant)
+    @param max_rank: [int] The variants with a higher MPA_ranking are not written (None to write all the variants)
+    @param rejected_stream: [file] The stream of the coordinates of the variants rejected by max_rank (None to not write them)
+    @param schema: [tuple] The INFO key of each annotation returned by compile_schema (None for the names of ANNOTATION_KEYS)
+    @return: [None]
+    """
+    schema = schema or DEFAULT_SCHEMA
+    clock = time.perf_counter
+    stream = vcf_writer.stream
+    index = getattr(stream, 'index', None)
+    memo_info = score_signature.cache_info()
+    for record in stats.timed(vcf_reader, 'read'):
+        stats.count('records')
+        start = clock()
+        try:
+            check_split_variants(record)
+        except SystemExit as e:
+            log.error(str(record))
+            log.error(str(e))
+            if trace_stream is not None:
+                trace_stream.write(format_trace(record.CHROM, record.POS, record.REF, record_alt(record), error=str(e)))
+            stats.add('check', clock() - start)
+            stats.count('skipped')
+            continue
+        checked = clock()
+        stats.add('check', checked - start)
+
+        annotations = dict((key, None if info_key is None else record.INFO[info_key][0]) for key, info_key in schema)
+        if trace_stream is None and cache is not None:
+            key = cache.key(record.CHROM, record.POS, record.REF, record_alt(record), annotations, record.is_indel)
+            mpa_scores = cache.get(key)
+            if mpa_scores is None:
+                mpa_scores = score_signature(annotation_signature(annotations), record.is_indel)
+                cache.put(key, mpa_scores)
+            else:
+                stats.count('cached')
+        elif trace_stream is None:
+            mpa_scores = score_signature(annotation_signature(annotations), record.is_indel)
+        else:
+            trace = dict()
+            mpa_scores = score_annotations(annotations, record.is_indel, trace)
+            trace_stream.write(format_trace(record.CHROM, record.POS, record.REF, record_alt(record), record.is_indel, mpa_scores, trace))
+
+        scored = clock()
+        stats.add('score', scored - checked)
+        stats.count('annotated')
+
+        # Variants with a low priority are not written
+        if max_rank is not None and mpa_scores['MPA_ranking'] > max_rank:
+            if rejected_stream is not None:
+                rejected_stream.write("\t".join([record.CHROM, str(record.POS), record.REF, record_alt(record)]) + "\n")
+            stats.add('write', clock() - scored)
+            stats.count('rejected')
+            continue
+
+        # write vcf output
+        for key in mpa_scores:
+            record.INFO[key] = mpa_scores[key]
+
+        if index is None:
+            vcf_writer.write_record(record)
+        else:
+            offset = stream.tell()
+            vcf_writer.write_record(record)
+            index.add_record(record.CHROM, record.POS, record.REF, record.INFO.get('END'), offset, stream.tell())
+        stats.add('write', clock() - scored)
+
+    count_memo(stats, memo_info)
+    return None
 
 ################################################################################
 #
 # PROCESS
 #
 ################################################################################
-def main(args, logger):
+def main(args, logger, stats=None):
     """
     @summary: Launch annotation with MPA score on a vcf.
     @param args: [Namespace] The namespace extract from the script arguments.
     param log: [Logger] The logger of the script.
+    @param stats: [PipelineStats] Filled with the time by stage and the counters of the annotation (None to use a new one)
     """
     global log
     log = logger
 
-    # TODO: improve this ! already existing on pyVCF
-    _Info = collections.namedtuple('Info', ['id', 'num', 'type', 'desc', 'source', 'version'])
-    info_MPA_adjusted = _Info("MPA_adjusted", ".", "String", "MPA_adjusted : normalize MPA missense score from 0 to 10", "MPA", "1.1.0")
-    info_MPA_available = _Info("MPA_available", ".", "String", "MPA_available : number of missense tools annotation available for this variant", "MPA", "1.1.0")
-    info_MPA_deleterious = _Info("MPA_deleterious", ".", "String", "MPA_deleterious : number of missense tools that annotate this variant pathogenic", "MPA", "1.1.0")
-    info_MPA_final_score = _Info("MPA_final_score", ".", "String", "MPA_final_score : unique score that take into account curated database, biological assumptions, splicing predictions and the sum of various predictors for missense alterations. Annotations are made for exonic and splicing variants up to +300nt.", "MPA", "1.1.0")
-    info_MPA_impact = _Info("MPA_impact", ".", "String", "MPA_impact : pathogenic predictions (clinvar_pathogenicity, splice_impact, stop and frameshift_impact)", "MPA", "1.1.0")
-    info_MPA_ranking = _Info("MPA_ranking", ".", "String", "MPA_ranking : prioritize variants with ranks from 1 to 10", "MPA", "1.1.0")
+    engine = getattr(args, 'engine', 'pyvcf')
+    raw_samples = getattr(args, 'raw_samples', False)
+    threads = getattr(args, 'threads', 1)
+    if engine == 'numpy' and columnar.numpy is None:
+        log.error("The numpy engine needs the python package numpy (pip install numpy)")
+        return 1
+    if raw_samples and engine == 'pyvcf':
+        log.info("Samples are copied without parsing: use raw engine")
+        engine = 'raw'
+    if threads > 1 and engine == 'pyvcf':
+        log.info("Variants are scored by " + str(threads) + " processes: use raw engine")
+        engine = 'raw'
+    pipelined = getattr(args, 'pipeline', False)
+    if pipelined and threads > 1:
+        log.info("Variants are scored by " + str(threads) + " processes: the pipeline is not used")
+        pipelined = False
+    if pipelined and engine == 'pyvcf':
+        log.info("Variants are read, scored and written by separate threads: use raw engine")
+        engine = 'raw'
+    annotations_only = getattr(args, 'annotations_only', False)
+    if annotations_only:
+        if engine == 'pyvcf':
+            log.info("Only the MPA values are written: use raw engine")
+            engine = 'raw'
+    # Without VCF output (nor selection of the variants), the rows of the table are built without formatting the VCF
+    table_only = (getattr(args, 'table', None) and args.output is None and not annotations_only
+        and not getattr(args, 'sort_by_rank', False) and getattr(args, 'top_k', None) is None)
+    if table_only and engine == 'pyvcf':
+        log.info("Only the table is written: use raw engine")
+        engine = 'raw'
+
+    # INFO key of each annotation
+    try:
+        schema = args_schema(args)
+    except (IOError, ValueError) as e:
+        log.error(str(e))
+        return 1
+    renamed = sorted(set((key, info_key) for key, info_key in schema if info_key != key))
+    if renamed:
+        log.info("Annotations read from other INFO: " + ", ".join(key + "=" + (info_key or NOT_AVAILABLE) for key, info_key in renamed))
 
-    with open(args.input, 'r') as f:
+    table_filename = getattr(args, 'table', None)
+    if table_filename and table.pyarrow is None:
+        log.error("The table output needs the python package pyarrow (pip install pyarrow)")
+        return 1
+
+    index_format = getattr(args, 'index_format', 'tbi')
+    sort_by_rank = getattr(args, 'sort_by_rank', False)
+    output_filename = args.output
+    if output_filename is None:
+        # Only the table is written
+        output_filename = os.devnull
+        index_format = None
+    if sort_by_rank and output_filename.endswith('.gz'):
+        log.info("Variants are sorted by rank: no index written for " + args.output)
+        index_format = None
+
+    # Regions to annotate (0-based start, end excluded)
+    selected_regions = None
+    if getattr(args, 'region', None) or getattr(args, 'regions_file', None):
+        if not args.input.endswith('.gz') or regions.find_index(args.input) is None:
+            log.error("Regions need a compressed VCF with its index (.tbi or .csi): " + args.input)
+            return 1
+        selected_regions = [regions.parse_region(region) for region in (getattr(args, 'region', None) or [])]
+        if getattr(args, 'regions_file', None):
+            try:
+                selected_regions.extend(regions.read_bed(args.regions_file))
+            except (IOError, ValueError) as e:
+                log.error(str(e))
+                return 1
+        if engine == 'pyvcf':
+            log.info("Only variants in regions are read from the index: use raw engine")
+            engine = 'raw'
+
+    if stats is None:
+        stats = mpa_stats.PipelineStats()
+    clock = time.perf_counter
+    with bgzf.open_input(args.input) as f:
         log.info("Read VCF")
-        vcf_reader = vcf.Reader(f)
-        # TODO: improve this
-        vcf_reader.infos.update({'MPA_adjusted':info_MPA_adjusted})
-        vcf_reader.infos.update({'MPA_available':info_MPA_available})
-        vcf_reader.infos.update({'MPA_deleterious':info_MPA_deleterious})
-        vcf_reader.infos.update({'MPA_final_score':info_MPA_final_score})
-        vcf_reader.infos.update({'MPA_impact':info_MPA_impact})
-        vcf_reader.infos.update({'MPA_ranking':info_MPA_ranking})
-        vcf_writer = vcf.Writer(open(args.output, 'w'), vcf_reader)
+        start = clock()
+        vcf_reader = vcf.Reader(f, compressed=False)
+        add_mpa_infos(vcf_reader)
+        table_keys = None
+        if table_only:
+            log.info("Write only the MPA values in the table " + table_filename)
+            output_stream = table.TableOnlyOutput(table.TableWriter(table_filename, getattr(args, 'table_info', None) or []))
+            table_keys = output_stream.table_keys()
+        else:
+            output_stream = bgzf.open_output(output_filename, index_format, getattr(args, 'compress_threads', 1))
+            if annotations_only:
+                log.info("Write only the MPA values of the variants")
+                output_stream = selection.AnnotationOnlyOutput(output_stream)
+            if table_filename:
+                log.info("Write the MPA values in the table " + table_filename)
+                output_stream = table.TableOutput(output_stream, table.TableWriter(table_filename, getattr(args, 'table_info', None) or []))
+        if sort_by_rank:
+            log.info("Sort the variants by rank")
+            output_stream = selection.RankSortedOutput(output_stream, getattr(args, 'sort_buffer', selection.DEFAULT_SORT_BUFFER), getattr(args, 'temporary_directory', None))
+        if getattr(args, 'top_k', None) is not None:
+            log.info("Keep the {} best variants".format(args.top_k))
+            output_stream = selection.TopKOutput(output_stream, args.top_k)
+        vcf_writer = vcf.Writer(output_stream, vcf_reader)
+        checked = clock()
+        stats.add('read', checked - start)
         log.info("Check vcf annotations")
 
         try:
-            check_annotation(vcf_reader.infos)
+            check_annotation(vcf_reader.infos, schema)
         except SystemExit as e:
             log.error(str(e))
+            vcf_writer.close()
             return 1
+        stats.add('check', clock() - checked)
+
+        trace_stream = None
+        if getattr(args, 'trace', None):
+            log.info("Trace the decisions of each variant in " + args.trace)
+            trace_stream = bgzf.open_output(args.trace, None)
+
+        max_rank = getattr(args, 'max_rank', None)
+        rejected_stream = None
+        if getattr(args, 'rejected', None):
+            log.info("Write the coordinates of the variants with a rank higher than {} in {}".format(max_rank, args.rejected))
+            rejected_stream = bgzf.open_output(args.rejected, None)
+            rejected_stream.write("#CHROM\tPOS\tREF\tALT\n")
+
+        cache = None
+        if getattr(args, 'cache', None):
+            if trace_stream is not None:
+                log.info("The decisions are traced: the cache is not used")
+            else:
+                log.info("Read the scores of the previous runs in " + args.cache)
+                cache = scorecache.ScoreCache(args.cache, getattr(args, 'cache_size', scorecache.DEFAULT_MAX_ENTRIES))
 
         log.info("Read the each variants")
-        for record in vcf_reader:
-            try:
-                check_split_variants(record)
-            except SystemExit as e:
-                log.error(str(record))
-                log.error(str(e))
-                continue
-            log.debug(str(record))
-
-            # Deleterious impact scores
-            impacts_scores = {
-                "SIFT" : record.INFO['SIFT_pred'][0],
-                "HDIV" : record.INFO['Polyphen2_HDIV_pred'][0],
-                "HVAR" : record.INFO['Polyphen2_HVAR_pred'][0],
-                "LRT" : record.INFO['LRT_pred'][0],
-                "MutationTaster" : record.INFO['MutationTaster_pred'][0],
-                "FATHMM" : record.INFO['FATHMM_pred'][0],
-                "PROVEAN" : record.INFO['PROVEAN_pred'][0],
-                "MKL" : record.INFO['fathmm-MKL_coding_pred'][0],
-                "SVM" : record.INFO['MetaSVM_pred'][0],
-                "LR" : record.INFO['MetaLR_pred'][0]
-            }
-
-            # Splicing impact scores
-            splices_scores = {
-                "ADA": record.INFO['dbscSNV_ADA_SCORE'][0],
-                "RF": record.INFO['dbscSNV_RF_SCORE'][0],
-                "spliceAI":record.INFO['spliceai_filtered'][0],
-            }
-
-            # MPA aggregate the information to predict some effects
-            meta_impact = {
-                "clinvar_pathogenicity": False,
-                "stop_impact": False,
-                "splice_impact": False,
-                "frameshift_impact": False,
-                "unknown_impact": False
-            }
-
-            # Calculate adjusted score for each variants
-            adjusted_score = calculate_adjusted_score(impacts_scores)
-
-            # Determine if variant is well annotated with clinvar as deleterious
-            meta_impact["clinvar_pathogenicity"] = is_clinvar_pathogenic(record.INFO['CLNSIG'][0])
-
-            # Determine the impact on splicing
-            meta_impact["splice_impact"] = is_splice_impact(splices_scores, record.is_indel, record.INFO['Func.refGene'][0])
-
-            # Determine the exonic impact
-            match_exonic = re.search("exonic", record.INFO['Func.refGene'][0], re.IGNORECASE)
-            if(match_exonic and record.INFO['ExonicFunc.refGene'][0] != None):
-                # Determine the stop impact
-                meta_impact["stop_impact"] = is_stop_impact(record.INFO['ExonicFunc.refGene'][0])
-
-                # Determine the frameshift impact
-                meta_impact["frameshift_impact"] = is_frameshift_impact(record.INFO['ExonicFunc.refGene'][0])
-
-                # Determine the missense impact
-                meta_impact["missense_impact"] = is_missense_impact(record.INFO['ExonicFunc.refGene'][0], adjusted_score["adjusted"])
-
-                # Determine if unknown impact (misunderstand gene)
-                # NOTE: /!\ Be careful to updates regularly your databases /!\
-                meta_impact["unknown_impact"] = is_unknown_impact(record.INFO['ExonicFunc.refGene'][0])
-            log.debug("Meta score : " + str(meta_impact))
-
-            # Ranking of variants
-            rank = False
-            record.INFO['MPA_impact'] = ""
-            for impact in meta_impact:
-                if (meta_impact[impact]):
-                    record.INFO['MPA_impact'] = record.INFO['MPA_impact'] + impact + ","
-                    if(meta_impact[impact]<rank or not rank):
-                        rank = meta_impact[impact]
-                        if(impact == "unknown_impact" or impact == "missense_impact"):
-                            adjusted_score["final_score"] = adjusted_score["adjusted"]
-                        elif(impact == "splice_impact" and meta_impact["splice_impact"] == 6):
-                            adjusted_score["final_score"] = 6
-                        elif(impact == "splice_impact" and meta_impact["splice_impact"] == 8):
-                            adjusted_score["final_score"] = 2
-                        else:
-                            adjusted_score["final_score"] = 10
-
-            # if not ranking default value 10
-            if not rank:
-                rank = 10
-                record.INFO['MPA_impact'] = "NULL,"
-                adjusted_score["final_score"] = adjusted_score["adjusted"]
-
-            log.debug("Ranking : " + str(rank))
-
-            # write vcf output
-            record.INFO['MPA_impact'] = record.INFO['MPA_impact'][:-1]
-            record.INFO['MPA_ranking'] = rank
-            for sc in adjusted_score:
-                record.INFO['MPA_' + sc] = adjusted_score[sc]
-
-            vcf_writer.write_record(record)
-        vcf_writer.close()
+        try:
+            if engine != 'pyvcf':
+                lines = None
+                if selected_regions is not None:
+                    lines = regions.fetch_lines(args.input, selected_regions)
+                rawvcf.annotate(vcf_reader, vcf_writer, log, raw_samples, threads, lines, engine == 'numpy', stats, trace_stream, cache,
+                    max_rank, rejected_stream, annotations_only, schema, pipelined, table_keys)
+            else:
+                annotate_records(vcf_reader, vcf_writer, stats, trace_stream, cache, max_rank, rejected_stream, schema)
+        finally:
+            if trace_stream is not None:
+                trace_stream.close()
+            if rejected_stream is not None:
+                rejected_stream.close()
+            if cache is not None:
+                start = clock()
+                cache.close()
+                stats.add('score', clock() - start)
+                log.info("{} variants found in the cache".format(stats.counts['cached']))
+
+        if stats.counts['prefiltered'] > 0:
+            log.info("{} variants without annotation used by MPA given the default values without scoring".format(stats.counts['prefiltered']))
+        nb_memo = stats.counts['memo_hits'] + stats.counts['memo_misses']
+        if nb_memo > 0:
+            log.info("{} variants scored from the same annotations of another variant ({:.1f}% of the scored variants)".format(
+                stats.counts['memo_hits'], 100.0 * stats.counts['memo_hits'] / nb_memo))
+
+        start = clock()
+        close_output(vcf_writer)
+        stats.add('write', clock() - start)
+
+    elapsed = stats.stop()
+    log.info("{} variants annotated, {} skipped in {:.1f} s ({:.0f} variants/s)".format(
+        stats.counts['annotated'], stats.counts['skipped'], elapsed, stats.counts['records'] / elapsed if elapsed > 0 else 0))
+    if stats.counts['rejected'] > 0:
+        log.info("{} variants with a rank higher than {} not written".format(stats.counts['rejected'], getattr(args, 'max_rank', None)))
+    if getattr(args, 'stats_json', None):
+        stats.write_json(args.stats_json, input=args.input, output=args.output or table_filename, engine=engine, threads=threads, version=__version__)
+        log.info("Stats written in " + args.stats_json)
+    return None
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+__author__ = 'Mobidic'
+__authors__ = ['Henri Pegeot','Kevin Yauy','Charles Van Goethem','David Baux']
+__copyright__ = 'Copyright (C) 2019'
+__license__ = 'Academic License Agreement'
+__version__ = '1.1.2'
+__email__ = 'h-pegeot@chu-montpellier.fr'
+__status__ = 'prod'
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import os         # os command
+import sys        # system command
+import time       # timers
+import argparse   # namespace of each VCF
+import logging    # logging messages
+import multiprocessing # pool of workers
+
+import mobidic_mpa
+from mobidic_mpa import stats as mpa_stats # time by stage
+
+################################################################################
+#
+# CONSTANTS
+#
+################################################################################
+# Columns of the summary
+SUMMARY_COLUMNS = ['input', 'output', 'status', 'records', 'annotated', 'skipped', 'seconds', 'message']
+
+################################################################################
+#
+# FUNCTIONS
+#
+################################################################################
+def read_manifest(filename):
+    """
+    @summary: Read the pairs of VCF of the manifest (one "input<TAB>output" by line, lines starting with "#" are ignored)
+    @param filename: [str] Path of the manifest
+    @return: [list] The tuples (input, output)
+    """
+    pairs = []
+    with open(filename) as handle:
+        for line_number, line in enumerate(handle, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            columns = line.split('\t') if '\t' in line else line.split()
+            if len(columns) != 2:
+                raise ValueError("Line {} of the manifest {} must contain an input and an output: {}".format(line_number, filename, line))
+            pairs.append((columns[0], columns[1]))
+    return pairs
+
+def schedule(pairs):
+    """
+    @summary: Returns the order of annotation of the VCF: largest inputs first (the last tasks of the pool are the shortest)
+    @param pairs: [list] The tuples (input, output)
+    @return: [list] The ranks of the pairs
+    """
+    def input_size(rank):
+        try:
+            return os.path.getsize(pairs[rank][0])
+        except OSError:
+            return 0
+    return sorted(range(len(pairs)), key=input_size, reverse=True)
+
+def _init_worker(logger_name, logger_level):
+    """
+    @summary: Prepare a worker process: use the logger of the script
+    @param logger_name: [str] The name of the logger of the script
+    @param logger_level: [int] The level of the logger of the script
+    @return: [None]
+    """
+    log = logging.getLogger(logger_name)
+    log.setLevel(logger_level)
+    return None
+
+def annotate_file(task):
+    """
+    @summary: Annotate one VCF of the manifest with mobidic_mpa.main
+    @param task: [tuple] The rank of the pair, the namespace of the VCF (input, output, engine...) and the name of the logger
+    @return: [tuple] The rank of the pair and its status (dict with keys from SUMMARY_COLUMNS)
+    """
+    rank, args, logger_name = task
+    log = logging.getLogger(logger_name)
+    stats = mpa_stats.PipelineStats()
+    status = {'input': args.input, 'output': args.output, 'status': 'ok', 'message': ''}
+    try:
+        if mobidic_mpa.main(args, log, stats) is not None:
+            status['status'] = 'failed'
+            status['message'] = 'see the log'
+    except (Exception, SystemExit) as e:
+        log.error("Annotation of " + args.input + " failed: " + str(e))
+        status['status'] = 'failed'
+        status['message'] = str(e).replace('\t', ' ').replace('\n', ' ')
+    for counter in ('records', 'annotated', 'skipped'):
+        status[counter] = stats.counts[counter]
+    status['seconds'] = round(time.perf_counter() - stats.start, 3)
+    return (rank, status)
+
+def write_summary(statuses, handle):
+    """
+    @summary: Write the status of each VCF as a tabulated summary
+    @param statuses: [list] The status of each VCF (dict with keys from SUMMARY_COLUMNS)
+    @param handle: [file] The output stream
+    @return: [None]
+    """
+    handle.write('\t'.join(SUMMARY_COLUMNS) + '\n')
+    for status in statuses:
+        handle.write('\t'.join(str(status[column]) for column in SUMMARY_COLUMNS) + '\n')
+    return None
+
+################################################################################
+#
+# PROCESS
+#
+################################################################################
+def main(args, log):
+    """
+    @summary: Annotate the VCF of a manifest with MPA score on one pool of processes (one VCF by process at a time).
+    @param args: [Namespace] The namespace extract from the script arguments (manifest, threads, summary and the options of each VCF).
+    @param log: [Logger] The logger of the script.
+    @return: [int] 0 if all the VCF are annotated ; 1 otherwise
+    """
+    pairs = read_manifest(args.manifest)
+    threads = max(1, getattr(args, 'threads', 1))
+    log.info("Annotate {} VCF on {} processes".format(len(pairs), threads))
+
+    # Each VCF is annotated by one process: the options of the annotation are shared by the VCF
+    options = dict((key, value) for key, value in vars(args).items() if key not in ('manifest', 'summary', 'threads'))
+    tasks = []
+    for rank in schedule(pairs):
+        file_args = argparse.Namespace(**options)
+        file_args.input, file_args.output = pairs[rank]
+        file_args.threads = 1
+        tasks.append((rank, file_args, log.name))
+
+    statuses = [None] * len(pairs)
+    pool = None
+    if threads > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(threads, len(tasks)), _init_worker, (log.name, log.getEffectiveLevel()))
+        results = pool.imap_unordered(annotate_file, tasks)
+    else:
+        results = map(annotate_file, tasks)
+    try:
+        for rank, status in results:
+            statuses[rank] = status
+            log.info("{} {}: {} variants in {} s".format(status['input'], status['status'], status['records'], status['seconds']))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    if getattr(args, 'summary', None):
+        with open(args.summary, 'w') as handle:
+            write_summary(statuses, handle)
+        log.info("Summary written in " + args.summary)
+    else:
+        write_summary(statuses, sys.stdout)
+
+    nb_failed = sum(1 for status in statuses if status['status'] != 'ok')
+    if nb_failed > 0:
+        log.error("{} VCF on {} not annotated".format(nb_failed, len(statuses)))
+        return 1
+    return 0
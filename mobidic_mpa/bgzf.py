@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+__author__ = 'Mobidic'
+__authors__ = ['Henri Pegeot','Kevin Yauy','Charles Van Goethem','David Baux']
+__copyright__ = 'Copyright (C) 2019'
+__license__ = 'Academic License Agreement'
+__version__ = '1.1.2'
+__email__ = 'h-pegeot@chu-montpellier.fr'
+__status__ = 'prod'
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import gzip       # read compressed vcf
+import struct     # binary format of BGZF blocks and index
+import zlib       # deflate
+import collections
+import concurrent.futures # compression threads
+
+################################################################################
+#
+# CONSTANTS
+#
+################################################################################
+# Maximum size of uncompressed data in one BGZF block (same as htslib)
+BLOCK_SIZE = 0xff00
+
+# Maximum size of a compressed BGZF block
+MAX_BLOCK_SIZE = 0x10000
+
+# Header of a BGZF block (without BSIZE)
+BLOCK_HEADER = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+
+# Empty block marking the end of a BGZF file
+EOF_BLOCK = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+
+# Tabix header for VCF: format, col_seq, col_beg, col_end, meta char and lines to skip
+TABIX_VCF_CONF = (2, 1, 2, 0, ord('#'), 0)
+
+# Binning scheme of .tbi index (and default minimal shift of .csi index)
+TBI_MIN_SHIFT = 14
+TBI_DEPTH = 5
+CSI_DEPTH = 6
+
+################################################################################
+#
+# CLASS
+#
+################################################################################
+class BgzfWriter(object):
+    """
+    @summary: Text stream writing a BGZF compressed file (readable by gzip, tabix and bgzip). The virtual offset of the current position is given by tell().
+    With several threads, the blocks are compressed in parallel and written in order: the address of a block is only known once the
+    previous blocks are compressed, so tell() returns the number of the block instead of its address and the records of the index
+    are added once their blocks are written (see resolve).
+    """
+    def __init__(self, filename, index_format=None, compresslevel=6, threads=1):
+        """
+        @param filename: [str] Path of the compressed file
+        @param index_format: [str/None] Format of the index written with the file ("tbi" or "csi"), None for no index
+        @param compresslevel: [int] Level of compression (0 to 9)
+        @param threads: [int] The number of threads compressing the blocks
+        """
+        self.name = filename
+        self.handle = open(filename, 'wb')
+        self.compresslevel = compresslevel
+        self.buffer = bytearray()
+        self.block_address = 0
+        self.index = None
+        if index_format is not None:
+            self.index = TabixIndex(filename + '.' + index_format, index_format)
+        self.executor = None
+        if threads > 1:
+            self.threads = threads
+            self.executor = concurrent.futures.ThreadPoolExecutor(threads)
+            # Blocks being compressed (in order) and, for the blocks written still used by the index, the address and the size of
+            # their BGZF blocks (first_layout is the number of the first one)
+            self.pending = collections.deque()
+            self.block_number = 0
+            self.layouts = collections.deque()
+            self.first_layout = 0
+            # Block of the last position returned by tell (the start of the record being written, not yet in the index)
+            self.told_block = 0
+            if self.index is not None:
+                self.index.deferred = collections.deque()
+
+    def write(self, text):
+        """
+        @summary: Write text in the file
+        @param text: [str] The text to write
+        @return: [None]
+        """
+        self.buffer += text.encode('utf-8')
+        if len(self.buffer) >= BLOCK_SIZE:
+            self._write_blocks()
+
+    def writelines(self, lines):
+        """
+        @summary: Write several lines in the file
+        @param lines: [iterable] The lines to write (with end of line)
+        @return: [None]
+        """
+        for line in lines:
+            self.write(line)
+
+    def tell(self):
+        """
+        @summary: Returns the BGZF virtual offset of the current position
+        @return: [int] The virtual offset (address of the block << 16 | offset in the block ; number of the block with several threads, see resolve)
+        """
+        if self.executor is not None:
+            self.told_block = self.block_number
+            return (self.block_number << 16) | len(self.buffer)
+        return (self.block_address << 16) | len(self.buffer)
+
+    def resolve(self, offset):
+        """
+        @summary: Returns the BGZF virtual offset of an offset returned by tell() with several threads (once its block is written
+        and while its layout is kept)
+        @param offset: [int] The number of the block << 16 | offset in the block
+        @return: [int] The virtual offset
+        """
+        block_number = offset >> 16
+        within = offset & 0xffff
+        if block_number >= self.first_layout + len(self.layouts):
+            return (self.block_address << 16) | within
+        # A block too large once compressed is split in two BGZF blocks
+        layout = self.layouts[block_number - self.first_layout]
+        for address, size in layout[:-1]:
+            if within < size:
+                return (address << 16) | within
+            within -= size
+        return (layout[-1][0] << 16) | within
+
+    def flush(self):
+        """
+        @summary: Compress and write the pending data
+        @return: [None]
+        """
+        self._write_blocks(flush=True)
+        if self.executor is not None:
+            self._write_pending(0)
+        self.handle.flush()
+
+    def close(self):
+        """
+        @summary: Write the last blocks, the EOF marker and the index
+        @return: [None]
+        """
+        if self.handle.closed:
+            return None
+        self._write_blocks(flush=True)
+        if self.executor is not None:
+            self._write_pending(0)
+            self.executor.shutdown()
+            if self.index is not None:
+                self.index.add_deferred(self.resolve)
+        self.handle.write(EOF_BLOCK)
+        self.handle.close()
+        if self.index is not None:
+            self.index.write()
+        return None
+
+    def _write_blocks(self, flush=False):
+        """
+        @summary: Compress the full blocks of the buffer (and the last partial block if flush)
+        @param flush: [bool] True to write also the last partial block
+        @return: [None]
+        """
+        while len(self.buffer) >= BLOCK_SIZE or (flush and self.buffer):
+            data = bytes(self.buffer[:BLOCK_SIZE])
+            del self.buffer[:BLOCK_SIZE]
+            if self.executor is not None:
+                self.pending.append(self.executor.submit(compress_block, data, self.compresslevel))
+                self.block_number += 1
+                self._write_pending(2 * self.threads)
+                continue
+            for block in compress_block(data, self.compresslevel):
+                self.handle.write(block)
+                self.block_address += len(block)
+
+    def _write_pending(self, max_pending):
+        """
+        @summary: Write the compressed blocks in order until at most max_pending blocks are being compressed
+        @param max_pending: [int] The number of blocks which can stay in compression (0 to write all the blocks)
+        @return: [None]
+        """
+        while self.pending and (len(self.pending) > max_pending or self.pending[0].done()):
+            layout = []
+            for block in self.pending.popleft().result():
+                self.handle.write(block)
+                layout.append((self.block_address, struct.unpack('<I', block[-4:])[0]))
+                self.block_address += len(block)
+            self.layouts.append(layout)
+            nb_written = self.first_layout + len(self.layouts)
+            # Add the records ended in the blocks written, then drop the layouts before the first record still deferred (or
+            # before the record being written)
+            first_needed = nb_written
+            if self.index is not None:
+                self.index.add_deferred(self.resolve, nb_written)
+                first_needed = self.told_block
+                if self.index.deferred:
+                    first_needed = min(first_needed, self.index.deferred[0][4] >> 16)
+            while self.layouts and self.first_layout < first_needed:
+                self.layouts.popleft()
+                self.first_layout += 1
+
+class BgzfReader(object):
+    """
+    @summary: Random access to the lines of a BGZF compressed file from their virtual offsets.
+    """
+    def __init__(self, filename):
+        """
+        @param filename: [str] Path of the compressed file
+        """
+        self.name = filename
+        self.handle = open(filename, 'rb')
+        self.address = None
+        self.data = b''
+        self.next_address = 0
+
+    def close(self):
+        """
+        @summary: Close the file
+        @return: [None]
+        """
+        self.handle.close()
+
+    def lines(self, start_offset, end_offset):
+        """
+        @summary: Read the lines starting between two virtual offsets
+        @param start_offset: [int] The virtual offset of the first line
+        @param end_offset: [int] The virtual offset after the last line
+        @return: [generator] The tuples (virtual offset, line without end of line)
+        """
+        self._load(start_offset >> 16)
+        offset = start_offset & 0xffff
+        line_offset = start_offset
+        pending = b''
+        while line_offset < end_offset:
+            if offset >= len(self.data):
+                if not self._load(self.next_address):
+                    if pending:
+                        yield line_offset, pending.decode('utf-8')
+                    return
+                offset = 0
+                if not pending:
+                    line_offset = self.address << 16
+                    continue
+            end = self.data.find(b'\n', offset)
+            if end < 0:
+                pending += self.data[offset:]
+                offset = len(self.data)
+                continue
+            yield line_offset, (pending + self.data[offset:end]).decode('utf-8')
+            pending = b''
+            offset = end + 1
+            line_offset = (self.address << 16) | offset
+            if offset >= len(self.data) and self._load(self.next_address):
+                offset = 0
+                line_offset = self.address << 16
+
+    def _load(self, address):
+        """
+        @summary: Decompress the block at an address of the file
+        @param address: [int] The address of the block in the compressed file
+        @return: [bool] False at the end of the file
+        """
+        if address == self.address:
+            return True
+        self.handle.seek(address)
+        header = self.handle.read(18)
+        if len(header) < 18:
+            return False
+        block_size = struct.unpack('<H', header[16:18])[0] + 1
+        block = self.handle.read(block_size - 18)
+        self.address = address
+        self.next_address = address + block_size
+        self.data = zlib.decompress(block[:-8], -15)
+        return True
+
+class TabixIndex(object):
+    """
+    @summary: Tabix index (.tbi or .csi) of a VCF built while the compressed records are written.
+    """
+    def __init__(self, filename, index_format='tbi'):
+        """
+        @param filename: [str] Path of the index
+        @param index_format: [str] "tbi" or "csi"
+        """
+        self.filename = filename
+        self.index_format = index_format
+        self.depth = TBI_DEPTH if index_format == 'tbi' else CSI_DEPTH
+        self.names = []
+        self.references = dict()
+        self.current = None
+        self.last_beg = -1
+        self.is_sorted = True
+        # Records waiting for the resolution of their offsets (None to add the records directly, see add_deferred)
+        self.deferred = None
+
+    def add(self, chrom, beg, end, start_offset, end_offset):
+        """
+        @summary: Add a record in the index
+        @param chrom: [str] The chromosome of the record
+        @param beg: [int] The 0-based start of the record
+        @param end: [int] The 0-based end (excluded) of the record
+        @param start_offset: [int] The virtual offset of the start of the record
+        @param end_offset: [int] The virtual offset of the end of the record
+        @return: [None]
+        """
+        if not self.is_sorted:
+            return None
+        if self.current is None or chrom != self.current.name:
+            if chrom in self.references:
+                self.is_sorted = False
+                return None
+            self.current = _Reference(chrom)
+            self.references[chrom] = self.current
+            self.names.append(chrom)
+            self.last_beg = -1
+        elif beg < self.last_beg:
+            self.is_sorted = False
+            return None
+        self.last_beg = beg
+        if end <= beg:
+            end = beg + 1
+
+        reference = self.current
+        bin_id = reg2bin(beg, end, TBI_MIN_SHIFT, self.depth)
+        chunks = reference.bins.setdefault(bin_id, [])
+        if chunks and chunks[-1][1] == start_offset:
+            chunks[-1][1] = end_offset
+        else:
+            chunks.append([start_offset, end_offset])
+
+        # Linear index: first record overlapping each window
+        linear = reference.linear
+        last_window = (end - 1) >> TBI_MIN_SHIFT
+        if len(linear) <= last_window:
+            linear.extend([None] * (last_window + 1 - len(linear)))
+        for window in range(beg >> TBI_MIN_SHIFT, last_window + 1):
+            if linear[window] is None:
+                linear[window] = start_offset
+
+        if reference.first_offset is None:
+            reference.first_offset = start_offset
+        reference.last_offset = end_offset
+        reference.nb_records += 1
+        return None
+
+    def add_record(self, chrom, pos, ref, info_end, start_offset, end_offset):
+        """
+        @summary: Add a VCF record in the index (interval computed as tabix -p vcf)
+        @param chrom: [str] The CHROM column
+        @param pos: [str/int] The POS column (1-based)
+        @param ref: [str] The REF column
+        @param info_end: [str/int/None] The value of the END INFO if present
+        @param start_offset: [int] The virtual offset of the start of the record
+        @param end_offset: [int] The virtual offset of the end of the record (offsets to resolve if deferred is not None)
+        @return: [None]
+        """
+        if self.deferred is not None:
+            self.deferred.append((chrom, pos, ref, info_end, start_offset, end_offset))
+            return None
+        return self._add_record(chrom, pos, ref, info_end, start_offset, end_offset)
+
+    def add_deferred(self, resolve, nb_blocks=None):
+        """
+        @summary: Add the deferred records ended in the blocks already written, with their resolved offsets
+        @param resolve: [function] Returns the virtual offset of an offset given to add_record
+        @param nb_blocks: [int] The number of blocks written (None to add all the deferred records)
+        @return: [None]
+        """
+        deferred = self.deferred
+        while deferred and (nb_blocks is None or deferred[0][5] >> 16 < nb_blocks):
+            chrom, pos, ref, info_end, start_offset, end_offset = deferred.popleft()
+            self._add_record(chrom, pos, ref, info_end, resolve(start_offset), resolve(end_offset))
+        return None
+
+    def _add_record(self, chrom, pos, ref, info_end, start_offset, end_offset):
+        """
+        @summary: Add a VCF record in the index (see add_record)
+        @return: [None]
+        """
+        beg = int(pos) - 1
+        end = beg + len(ref)
+        if isinstance(info_end, list):
+            info_end = info_end[0]
+        if info_end is not None:
+            try:
+                end = int(info_end)
+            except ValueError:
+                pass
+        return self.add(chrom, beg, end, start_offset, end_offset)
+
+    def write(self):
+        """
+        @summary: Write the index (BGZF compressed). Nothing is written if the records are not sorted.
+        @return: [bool] True if the index is written
+        """
+        if not self.is_sorted:
+            return False
+
+        names = b''.join(name.encode('utf-8') + b'\x00' for name in self.names)
+        conf = struct.pack('<6i', *TABIX_VCF_CONF) + struct.pack('<i', len(names)) + names
+        if self.index_format == 'tbi':
+            data = [b'TBI\x01', struct.pack('<i', len(self.names)), conf]
+        else:
+            data = [b'CSI\x01', struct.pack('<3i', TBI_MIN_SHIFT, self.depth, len(conf)), conf, struct.pack('<i', len(self.names))]
+
+        pseudo_bin = ((1 << (3 * (self.depth + 1))) - 1) // 7 + 1
+        for name in self.names:
+            reference = self.references[name]
+            linear = reference.fill_linear()
+            bins = sorted(reference.bins.items())
+            data.append(struct.pack('<i', len(bins) + 1))
+            for bin_id, chunks in bins:
+                if self.index_format == 'tbi':
+                    data.append(struct.pack('<Ii', bin_id, len(chunks)))
+                else:
+                    window = bin_first_window(bin_id, self.depth)
+                    loffset = linear[window] if window < len(linear) else 0
+                    data.append(struct.pack('<IQi', bin_id, loffset, len(chunks)))
+                data.append(b''.join(struct.pack('<QQ', chunk[0], chunk[1]) for chunk in chunks))
+            # Pseudo-bin with the offsets and the number of records of the reference
+            if self.index_format == 'tbi':
+                data.append(struct.pack('<Ii', pseudo_bin, 2))
+            else:
+                data.append(struct.pack('<IQi', pseudo_bin, 0, 2))
+            data.append(struct.pack('<QQQQ', reference.first_offset, reference.last_offset, reference.nb_records, 0))
+            if self.index_format == 'tbi':
+                data.append(struct.pack('<i', len(linear)))
+                data.append(b''.join(struct.pack('<Q', offset) for offset in linear))
+        data.append(struct.pack('<Q', 0))
+
+        with open(self.filename, 'wb') as handle:
+            raw = b''.join(data)
+            for start in range(0, len(raw), BLOCK_SIZE):
+                for block in compress_block(raw[start:start + BLOCK_SIZE]):
+                    handle.write(block)
+            handle.write(EOF_BLOCK)
+        return True
+
+class _Reference(object):
+    """
+    @summary: Bins and linear index of one reference sequence.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.bins = dict()
+        self.linear = []
+        self.first_offset = None
+        self.last_offset = 0
+        self.nb_records = 0
+
+    def fill_linear(self):
+        """
+        @summary: Fill the windows without record as htslib (first offset before the first record, previous offset after)
+        @return: [list] The offset of each window
+        """
+        linear = list(self.linear)
+        previous = self.first_offset
+        for index, offset in enumerate(linear):
+            if offset is None:
+                linear[index] = previous
+            else:
+                previous = offset
+        return linear
+
+################################################################################
+#
+# FUNCTIONS
+#
+################################################################################
+def compress_block(data, compresslevel=6):
+    """
+    @summary: Compress data in BGZF blocks (the data is split if the compressed block is too large)
+    @param data: [bytes] The uncompressed data (at most BLOCK_SIZE bytes)
+    @param compresslevel: [int] Level of compression (0 to 9)
+    @return: [list] The BGZF blocks
+    """
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    block_size = len(BLOCK_HEADER) + 2 + len(deflated) + 8
+    if block_size > MAX_BLOCK_SIZE:
+        middle = len(data) // 2
+        return compress_block(data[:middle], compresslevel) + compress_block(data[middle:], compresslevel)
+    return [
+        BLOCK_HEADER + struct.pack('<H', block_size - 1) + deflated
+        + struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+    ]
+
+def reg2bin(beg, end, min_shift, depth):
+    """
+    @summary: Returns the bin of an interval in the binning scheme of htslib
+    @param beg: [int] The 0-based start
+    @param end: [int] The 0-based end (excluded)
+    @param min_shift: [int] The size of the smallest bins (1 << min_shift)
+    @param depth: [int] The number of levels
+    @return: [int] The bin
+    """
+    end -= 1
+    level = depth
+    shift = min_shift
+    first = ((1 << (depth * 3)) - 1) // 7
+    while level > 0:
+        if beg >> shift == end >> shift:
+            return first + (beg >> shift)
+        level -= 1
+        shift += 3
+        first -= 1 << (level * 3)
+    return 0
+
+def bin_first_window(bin_id, depth):
+    """
+    @summary: Returns the first window of the linear index covered by a bin
+    @param bin_id: [int] The bin
+    @param depth: [int] The number of levels
+    @return: [int] The window
+    """
+    level = 0
+    parent = bin_id
+    while parent:
+        level += 1
+        parent = (parent - 1) >> 3
+    first = ((1 << (level * 3)) - 1) // 7
+    return (bin_id - first) << ((depth - level) * 3)
+
+def open_input(filename):
+    """
+    @summary: Open a VCF as text (gzip and BGZF compressed file when the name ends with ".gz")
+    @param filename: [str] The path of the VCF
+    @return: [file] The text stream
+    """
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt')
+    return open(filename, 'r')
+
+def open_output(filename, index_format='tbi', threads=1):
+    """
+    @summary: Open the output VCF as text (BGZF compressed and indexed when the name ends with ".gz")
+    @param filename: [str] The path of the VCF
+    @param index_format: [str/None] Format of the index of compressed output ("tbi" or "csi"), None for no index
+    @param threads: [int] The number of threads compressing the blocks of a compressed output
+    @return: [file] The text stream
+    """
+    if filename.endswith('.gz'):
+        return BgzfWriter(filename, index_format, threads=threads)
+    return open(filename, 'w')
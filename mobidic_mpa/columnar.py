@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+__author__ = 'Mobidic'
+__authors__ = ['Henri Pegeot','Kevin Yauy','Charles Van Goethem','David Baux']
+__copyright__ = 'Copyright (C) 2019'
+__license__ = 'Academic License Agreement'
+__version__ = '1.1.2'
+__email__ = 'h-pegeot@chu-montpellier.fr'
+__status__ = 'prod'
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+try:
+    import numpy  # array operations (optional: only needed by the numpy engine)
+except ImportError:
+    numpy = None
+
+import mobidic_mpa
+
+################################################################################
+#
+# CONSTANTS
+#
+################################################################################
+# Missense predictors (as in score_annotations)
+PREDICTOR_KEYS = [
+    'SIFT_pred',
+    'Polyphen2_HDIV_pred',
+    'Polyphen2_HVAR_pred',
+    'LRT_pred',
+    'MutationTaster_pred',
+    'FATHMM_pred',
+    'PROVEAN_pred',
+    'fathmm-MKL_coding_pred',
+    'MetaSVM_pred',
+    'MetaLR_pred'
+]
+
+# Impacts in the order of meta_impact in score_annotations (missense_impact is added last)
+IMPACTS = [
+    'clinvar_pathogenicity',
+    'stop_impact',
+    'splice_impact',
+    'frameshift_impact',
+    'unknown_impact',
+    'missense_impact'
+]
+CLINVAR, STOP, SPLICE, FRAMESHIFT, UNKNOWN, MISSENSE = range(len(IMPACTS))
+
+# MPA_impact for each combination of impacts (bit i set for IMPACTS[i])
+IMPACT_NAMES = [','.join(IMPACTS[i] for i in range(len(IMPACTS)) if mask >> i & 1) or 'NULL' for mask in range(1 << len(IMPACTS))]
+
+# Rank of the variants without impact
+NO_RANK = 99
+
+################################################################################
+#
+# FUNCTIONS
+#
+################################################################################
+def column(annotations, key):
+    """
+    @summary: Returns the values of one annotation for a block of variants
+    @param annotations: [list] For each variant, the dictionnary of annotations
+    @param key: [str] The annotation
+    @return: [numpy.ndarray] The values (object array, None if not available)
+    """
+    values = numpy.empty(len(annotations), dtype=object)
+    values[:] = [variant[key] for variant in annotations]
+    return values
+
+def categories(values, classify):
+    """
+    @summary: Classify each distinct value once
+    @param values: [list] The values of one annotation
+    @param classify: [function] Returns the tuple of properties of one value
+    @return: [list] The properties of each value (None if classify raised an error)
+    """
+    known = dict()
+    properties = []
+    for value in values:
+        try:
+            properties.append(known[value])
+        except KeyError:
+            try:
+                known[value] = classify(value)
+            except Exception:
+                known[value] = None
+            properties.append(known[value])
+        except TypeError: # unhashable value
+            properties.append(None)
+    return properties
+
+def classify_func(func):
+    """
+    @summary: Properties of a Func.refGene value used by the ranking
+    @param func: [str] The Func.refGene annotation
+    @return: [tuple] (exonic, splicing)
+    """
+    return tuple(mobidic_mpa.classify_func(func))
+
+def classify_exonic_func(exonic_func):
+    """
+    @summary: Properties of an ExonicFunc.refGene value used by the ranking
+    @param exonic_func: [str] The ExonicFunc.refGene annotation
+    @return: [tuple] (stop rank, frameshift rank, missense, unknown rank) with 0 if no impact
+    """
+    if exonic_func is None:
+        return (0, 0, False, 0)
+    impacts = mobidic_mpa.classify_exonic_func(exonic_func)
+    return (int(impacts.stop), int(impacts.frameshift), impacts.missense, int(impacts.unknown))
+
+def classify_clnsig(clnsig):
+    """
+    @summary: Properties of a CLNSIG value used by the ranking
+    @param clnsig: [str] The ClinVar significance
+    @return: [tuple] (clinvar rank,) with 0 if not pathogenic
+    """
+    return (int(mobidic_mpa.is_clinvar_pathogenic(clnsig)),)
+
+def spliceai_max(spliceai):
+    """
+    @summary: Maximum of the delta scores of a spliceai_filtered value as is_splice_impact
+    @param spliceai: [str] The spliceai_filtered annotation
+    @return: [float] The maximum score (NaN if no annotation)
+    """
+    if spliceai is None:
+        return float('nan')
+    return mobidic_mpa.parse_spliceai(spliceai).max
+
+def to_float(value):
+    """
+    @summary: Convert a dbscSNV score as is_splice_impact
+    @param value: [str/float/None] The score
+    @return: [float] The score (NaN if no annotation)
+    """
+    if value is None:
+        return float('nan')
+    return float(value)
+
+def score_batch(annotations, indels):
+    """
+    @summary: Compute the MPA scores of a block of variants with array operations (same results as score_annotations)
+    @param annotations: [list] For each variant, the first value of each annotation listed in ANNOTATION_KEYS (None if not available)
+    @param indels: [list] For each variant, True if the variant is an indel
+    @return: [list] For each variant, the MPA values (keys from MPA_KEYS) to add in the INFO of the variant
+    """
+    nb_variants = len(annotations)
+    if nb_variants == 0:
+        return []
+    # Variants with values that cannot be decoded are scored one by one (same errors as score_annotations)
+    fallback = numpy.zeros(nb_variants, dtype=bool)
+
+    # Missense predictors
+    deleterious = numpy.zeros(nb_variants, dtype=numpy.int64)
+    available = numpy.zeros(nb_variants, dtype=numpy.int64)
+    for key in PREDICTOR_KEYS:
+        values = column(annotations, key)
+        is_deleterious = (values == "D") | (values == "A")
+        deleterious += is_deleterious
+        available += is_deleterious | numpy.not_equal(values, None)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        adjusted = deleterious / available * 10
+
+    # Categories of Func.refGene, ExonicFunc.refGene and CLNSIG
+    func = categories([variant['Func.refGene'] for variant in annotations], classify_func)
+    exonic_func = categories([variant['ExonicFunc.refGene'] for variant in annotations], classify_exonic_func)
+    clnsig = categories([variant['CLNSIG'] for variant in annotations], classify_clnsig)
+    for properties in (func, exonic_func, clnsig):
+        for position, value in enumerate(properties):
+            if value is None:
+                fallback[position] = True
+    func = numpy.array([value or (False, False) for value in func], dtype=bool).reshape(nb_variants, 2)
+    exonic_func = numpy.array([value or (0, 0, False, 0) for value in exonic_func], dtype=numpy.int64).reshape(nb_variants, 4)
+    clnsig = numpy.array([value or (0,) for value in clnsig], dtype=numpy.int64).reshape(nb_variants)
+
+    # Splicing scores
+    splices = []
+    for position, variant in enumerate(annotations):
+        try:
+            splices.append((to_float(variant['dbscSNV_ADA_SCORE']), to_float(variant['dbscSNV_RF_SCORE']), spliceai_max(variant['spliceai_filtered'])))
+        except Exception:
+            splices.append((float('nan'),) * 3)
+            fallback[position] = True
+    splices = numpy.array(splices, dtype=float)
+    spliceai = splices[:, 2]
+    splice = numpy.select(
+        [(splices[:, 1] >= 0.6) | (splices[:, 0] >= 0.6),
+         spliceai > 0.8,
+         spliceai > 0.5,
+         (spliceai > 0.2) | (numpy.array(indels, dtype=bool) & func[:, 1])],
+        [3, 4, 6, 8], 0)
+
+    # Impacts (0 if no impact) in the order of meta_impact
+    impacts = numpy.zeros((nb_variants, len(IMPACTS)), dtype=numpy.int64)
+    exonic = func[:, 0] & numpy.not_equal(column(annotations, 'ExonicFunc.refGene'), None)
+    impacts[:, CLINVAR] = clnsig
+    impacts[:, STOP] = numpy.where(exonic, exonic_func[:, 0], 0)
+    impacts[:, SPLICE] = splice
+    impacts[:, FRAMESHIFT] = numpy.where(exonic, exonic_func[:, 1], 0)
+    impacts[:, UNKNOWN] = numpy.where(exonic, exonic_func[:, 3], 0)
+    impacts[:, MISSENSE] = numpy.where(exonic & (exonic_func[:, 2] != 0),
+        numpy.select([adjusted > 6, adjusted > 2], [5, 7], 9), 0)
+
+    # Ranking: the first impact with the lowest rank defines the final score
+    has_impact = impacts > 0
+    ranks = numpy.where(has_impact, impacts, NO_RANK)
+    best = ranks.argmin(axis=1)
+    rank = ranks[numpy.arange(nb_variants), best]
+    no_rank = rank == NO_RANK
+    use_adjusted = no_rank | (best == UNKNOWN) | (best == MISSENSE)
+    final_score = numpy.select([best != SPLICE, splice == 6, splice == 8], [10, 6, 2], 10)
+    masks = (has_impact << numpy.arange(len(IMPACTS))).sum(axis=1)
+    rank[no_rank] = 10
+
+    # Python values as in score_annotations (adjusted is the integer 0 without available tool)
+    adjusted = [value if count else 0 for value, count in zip(adjusted.tolist(), available.tolist())]
+    final_score = [value if from_adjusted else score for value, from_adjusted, score in zip(adjusted, use_adjusted.tolist(), final_score.tolist())]
+    mpa_scores = [{
+        'MPA_impact': IMPACT_NAMES[mask],
+        'MPA_ranking': variant_rank,
+        'MPA_adjusted': variant_adjusted,
+        'MPA_available': variant_available,
+        'MPA_deleterious': variant_deleterious,
+        'MPA_final_score': variant_final
+    } for mask, variant_rank, variant_adjusted, variant_available, variant_deleterious, variant_final
+        in zip(masks.tolist(), rank.tolist(), adjusted, available.tolist(), deleterious.tolist(), final_score)]
+    for position in numpy.flatnonzero(fallback).tolist():
+        mpa_scores[position] = mobidic_mpa.score_annotations(annotations[position], indels[position])
+    return mpa_scores
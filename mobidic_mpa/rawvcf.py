@@ -0,0 +1,915 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+__author__ = 'Mobidic'
+__authors__ = ['Henri Pegeot','Kevin Yauy','Charles Van Goethem','David Baux']
+__copyright__ = 'Copyright (C) 2019'
+__license__ = 'Academic License Agreement'
+__version__ = '1.1.2'
+__email__ = 'h-pegeot@chu-montpellier.fr'
+__status__ = 'prod'
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import re         # regex
+import time       # timers
+import io         # in memory header
+import logging    # logging messages
+import multiprocessing # process pool
+import multiprocessing.util # close the caches of the workers
+import threading  # stages of the pipeline
+import queue      # chunks between the stages of the pipeline
+import functools  # patterns of the prefilter
+import collections
+import vcf        # read vcf => PyVCF :https://pyvcf.readthedocs.io/en/latest/
+import vcf.parser # RESERVED_INFO and RESERVED_FORMAT types
+
+import mobidic_mpa
+from mobidic_mpa import columnar # vectorized scoring
+from mobidic_mpa import stats as mpa_stats # time by stage
+from mobidic_mpa import scorecache # scores of the previous runs
+
+################################################################################
+#
+# CONSTANTS
+#
+################################################################################
+# Values read as None by PyVCF
+MISSING_VALUES = frozenset(['.', '', 'NA'])
+
+# PyVCF split the columns on tabulations and spaces (strict_whitespace=False)
+ROW_PATTERN = re.compile('\t| +')
+
+# INFO keys extracted from each line in addition to the annotations (SVTYPE for is_indel and END for the index)
+EXTRA_KEYS = ['SVTYPE', 'END']
+
+# Beginnings of the raw values whose first value is missing (see first_value)
+MISSING_PREFIXES = (';', ',', '.;', '.,', 'NA;', 'NA,')
+
+# Annotation which alone cannot give a MPA value (splicing is checked apart): the variants without other annotation are prefiltered
+PREFILTER_FUNC_KEY = 'Func.refGene'
+
+# Number of lines scored together (by a worker process when several are used)
+CHUNK_SIZE = 1000
+
+# Maximum number of chunks waiting between two stages of the pipeline (the reader waits when the scoring is late and the reverse)
+PIPELINE_QUEUE_SIZE = 4
+
+# Maximum number of distinct lists of INFO keys kept with their order
+ORDER_CACHE_SIZE = 1024
+
+# Types of values
+FLAG = 'Flag'
+INTEGER = 'Integer'
+FLOAT = 'Float'
+STRING = 'String'
+
+################################################################################
+#
+# CLASS
+#
+################################################################################
+class RawVariant(collections.namedtuple('RawVariant', ['CHROM', 'POS', 'REF', 'ALT'])):
+    """
+    @summary: Minimal variant built from the raw columns of a VCF line (enough for check_split_variants).
+    """
+    def __str__(self):
+        return "Record(CHROM=%s, POS=%s, REF=%s, ALT=[%s])" % (self.CHROM, self.POS, self.REF, ", ".join(self.ALT))
+
+class RawRecordFormatter(object):
+    """
+    @summary: Serializes a raw VCF line exactly as vcf.Writer does after a read by vcf.Reader. Only the values whose text is changed by PyVCF (numbers, missing values, INFO order) are decoded ; the other values stay raw text.
+    """
+    def __init__(self, vcf_reader, raw_samples=False, annotations_only=False, schema=None, table_keys=None):
+        """
+        @param vcf_reader: [vcf.Reader] The reader of the VCF (header already parsed, MPA INFO already declared)
+        @param raw_samples: [bool] True to copy the FORMAT and sample columns without parsing them
+        @param annotations_only: [bool] True to write only CHROM, POS, ID, REF, ALT and the MPA INFO (the other INFO are not serialized)
+        @param schema: [tuple] The INFO key of each annotation returned by compile_schema (None for the names of ANNOTATION_KEYS)
+        @param table_keys: [list] When only the table is written, the INFO of the table: format_record returns the row of the
+        table (see table.TableWriter.add_row) instead of the line and only these INFO are serialized (None to write the VCF)
+        """
+        self.schema = schema or mobidic_mpa.DEFAULT_SCHEMA
+        # INFO keys extracted from each line
+        self.keys = frozenset(mobidic_mpa.schema_info_keys(self.schema) + EXTRA_KEYS + list(table_keys or []))
+        self.annotations_only = annotations_only
+        self.table_only = table_keys is not None
+        self.raw_samples = raw_samples or annotations_only or self.table_only
+        self.nb_samples = len(vcf_reader.samples)
+
+        # Type and number of each INFO declared in header
+        self.infos = dict()
+        for key, info in vcf_reader.infos.items():
+            self.infos[key] = (_get_type(info.type), info.num == 1)
+
+        # Order of INFO used by vcf.Writer (header order then alphabetical order)
+        self.info_order = dict()
+        for index, key in enumerate(vcf_reader.infos):
+            self.info_order[key] = (index, key)
+        self.nb_infos = len(vcf_reader.infos)
+        self.order_cache = dict()
+
+        self.formats = dict()
+        for key, fmt in vcf_reader.formats.items():
+            self.formats[key] = (_get_type(fmt.type), fmt.num)
+        self.format_cache = dict()
+
+    def split(self, line):
+        """
+        @summary: Split a line of the VCF in columns
+        @param line: [str] The line without end of line
+        @return: [list] The columns (with raw_samples, the FORMAT and sample columns stay in one slice)
+        """
+        if self.raw_samples:
+            return line.split('\t', 8)
+        if ' ' in line:
+            return ROW_PATTERN.split(line)
+        return line.split('\t')
+
+    def parse_info(self, info):
+        """
+        @summary: Split the INFO column in serialized entries and extract the raw values of the expected keys
+        @param info: [str] The INFO column
+        @return: [tuple] The dictionnary of serialized entries by key and the dictionnary of raw values of the expected keys
+        """
+        entries = dict()
+        values = dict()
+        if info == '.':
+            return entries, values
+
+        infos = self.infos
+        keys = self.keys
+        if self.annotations_only:
+            for entry in info.split(';'):
+                key, sep, value = entry.partition('=')
+                if key in keys:
+                    values[key] = value if sep else None
+            return entries, values
+        if self.table_only:
+            # Only the INFO extracted are serialized
+            info = ';'.join([entry for entry in info.split(';') if entry.partition('=')[0] in keys])
+
+        for entry in info.split(';'):
+            key, sep, value = entry.partition('=')
+            if key in keys:
+                values[key] = value if sep else None
+            try:
+                entry_type, single = infos[key]
+            except KeyError:
+                single = False
+                entry_type = _get_type(vcf.parser.RESERVED_INFO.get(key, STRING if sep else FLAG))
+
+            if value == '.' and entry_type != FLAG:
+                entries[key] = entry
+            elif entry_type == STRING and sep and not single and _is_raw_string(value):
+                entries[key] = entry
+            elif entry_type == FLAG or not sep:
+                entries[key] = key
+            else:
+                if single:
+                    value = value.split(',', 1)[0]
+                entries[key] = key + '=' + _format_values(value, entry_type)
+        return entries, values
+
+    def is_sv(self, values):
+        """
+        @summary: Define if the variant is a structural variant as record.is_sv in PyVCF
+        @param values: [dict] The raw values extracted by parse_info
+        @return: [bool] True if the SVTYPE INFO is defined
+        """
+        if 'SVTYPE' not in values:
+            return False
+        value = values['SVTYPE']
+        if value is None or not self.infos.get('SVTYPE', (STRING, False))[1]:
+            return True
+        return first_value(value) is not None
+
+    def format_info(self, entries):
+        """
+        @summary: Serialize the INFO column in the order of vcf.Writer
+        @param entries: [dict] The serialized entries by key
+        @return: [str] The INFO column
+        """
+        if not entries:
+            return '.'
+        # Records usually share the same INFO keys: the sort is done once by list of keys
+        keys = tuple(entries)
+        try:
+            ordered_keys = self.order_cache[keys]
+        except KeyError:
+            if len(self.order_cache) >= ORDER_CACHE_SIZE:
+                self.order_cache.clear()
+            info_order = self.info_order
+            nb_infos = self.nb_infos
+            ordered_keys = self.order_cache[keys] = sorted(keys, key=lambda key: info_order.get(key) or (nb_infos, key))
+        return ';'.join([entries[key] for key in ordered_keys])
+
+    def format_samples(self, fmt, samples):
+        """
+        @summary: Serialize the sample columns as vcf.Writer
+        @param fmt: [str] The FORMAT column
+        @param samples: [list] The raw sample columns
+        @return: [list] The serialized sample columns
+        """
+        try:
+            layout = self.format_cache[fmt]
+        except KeyError:
+            layout = self.format_cache[fmt] = self._compile_format(fmt)
+        gt_index, default_gt, converters = layout
+
+        columns = []
+        for sample in samples[:self.nb_samples]:
+            tokens = sample.split(':')
+            nb_tokens = len(tokens)
+            if gt_index is None:
+                gt = default_gt
+            else:
+                gt = tokens[gt_index] if gt_index < nb_tokens else None
+            result = [gt] if gt else []
+            for index, converter in converters:
+                result.append(converter(tokens[index] if index < nb_tokens else None))
+            columns.append(':'.join(result))
+        return columns
+
+    def format_record(self, row, entries):
+        """
+        @summary: Serialize a line of the VCF as vcf.Writer
+        @param row: [list] The raw columns of the line
+        @param entries: [dict] The serialized INFO entries by key
+        @return: [str/tuple] The line with end of line ; when only the table is written, the CHROM, POS, REF, ALT and the INFO values by key
+        """
+        if self.table_only:
+            return (row[0], int(row[1]), row[3], _format_alt(row[4]), dict((key, entry.partition('=')[2]) for key, entry in entries.items()))
+        if self.annotations_only:
+            return '\t'.join([row[0], str(int(row[1])), row[2], row[3], _format_alt(row[4]), '.', '.', self.format_info(entries)]) + '\n'
+        columns = [
+            row[0],
+            str(int(row[1])),
+            row[2],
+            row[3],
+            _format_alt(row[4]),
+            _format_qual(row[5]),
+            row[6],
+            self.format_info(entries)
+        ]
+        if self.raw_samples:
+            columns.extend(row[8:])
+        elif len(row) > 8 and row[8] != '.':
+            columns.append(row[8])
+            columns.extend(self.format_samples(row[8], row[9:]))
+        return '\t'.join(columns) + '\n'
+
+    def _compile_format(self, fmt):
+        """
+        @summary: Prepare the serialization of the samples for a FORMAT
+        @param fmt: [str] The FORMAT column
+        @return: [tuple] The index of GT (or None), the GT used when absent and the converters of the other fields
+        """
+        fields = fmt.split(':')
+        gt_index = None
+        converters = []
+        for index, field in enumerate(fields):
+            if field == 'GT':
+                gt_index = index
+            elif field == 'FT':
+                converters.append((index, _format_filter_sample))
+            else:
+                try:
+                    entry_type, entry_num = self.formats[field]
+                except KeyError:
+                    entry_num = None
+                    entry_type = _get_type(vcf.parser.RESERVED_FORMAT.get(field, STRING))
+                converters.append((index, _sample_converter(entry_type, entry_num == 1)))
+        # vcf.Writer adds a missing genotype when "GT" is found in the FORMAT
+        default_gt = './.' if 'GT' in fmt else ''
+        return gt_index, default_gt, converters
+
+################################################################################
+#
+# FUNCTIONS
+#
+################################################################################
+def _get_type(header_type):
+    """
+    @summary: Returns the type used to read a value from the type declared in header
+    @param header_type: [str] The type declared in header
+    @return: [str] FLAG, INTEGER, FLOAT or STRING
+    """
+    if header_type == 'Integer':
+        return INTEGER
+    elif header_type in ('Float', 'Numeric'):
+        return FLOAT
+    elif header_type == 'Flag':
+        return FLAG
+    return STRING
+
+def _is_raw_string(value):
+    """
+    @summary: Define if a string value is written unchanged by PyVCF
+    @param value: [str] The raw value
+    @return: [bool] True if no empty or "NA" value is present in the list
+    """
+    return (value != '' and 'NA' not in value and ',,' not in value
+        and value[0] != ',' and value[-1] != ',')
+
+def _format_values(value, entry_type):
+    """
+    @summary: Serialize a list of values as PyVCF after conversion to the expected type
+    @param value: [str] The raw values separated by comma
+    @param entry_type: [str] INTEGER, FLOAT or STRING
+    @return: [str] The serialized values
+    """
+    vals = value.split(',')
+    if entry_type == INTEGER:
+        try:
+            vals = [str(int(val)) if val not in MISSING_VALUES else '.' for val in vals]
+        except ValueError:
+            vals = [str(float(val)) if val not in MISSING_VALUES else '.' for val in vals]
+    elif entry_type == FLOAT:
+        vals = [str(float(val)) if val not in MISSING_VALUES else '.' for val in vals]
+    else:
+        vals = [val if val not in MISSING_VALUES else '.' for val in vals]
+    return ','.join(vals)
+
+def _format_alt(alt):
+    """
+    @summary: Serialize the ALT column as vcf.Writer
+    @param alt: [str] The raw ALT column
+    @return: [str] The ALT column
+    """
+    if alt in MISSING_VALUES:
+        return '.'
+    if ',' not in alt:
+        return alt
+    return ','.join(val if val not in MISSING_VALUES else '.' for val in alt.split(','))
+
+def _format_qual(qual):
+    """
+    @summary: Serialize the QUAL column as vcf.Writer
+    @param qual: [str] The raw QUAL column
+    @return: [str] The QUAL column
+    """
+    try:
+        value = int(qual)
+    except ValueError:
+        try:
+            value = float(qual)
+        except ValueError:
+            return '.'
+    return str(value) if value else '.'
+
+def _format_filter_sample(value):
+    """
+    @summary: Serialize the FT field of a sample as vcf.Writer
+    @param value: [str/None] The raw value
+    @return: [str] The serialized value
+    """
+    return '.' if value is None else value
+
+def _sample_converter(entry_type, single):
+    """
+    @summary: Returns the function that serializes one field of a sample as vcf.Writer
+    @param entry_type: [str] INTEGER, FLOAT or STRING
+    @param single: [bool] True if the field is declared with only one value
+    @return: [function] The converter
+    """
+    def converter(value):
+        if not value or value == '.':
+            return '.'
+        if not single:
+            return value if entry_type == STRING else _format_values(value, entry_type)
+        if entry_type == INTEGER:
+            try:
+                return str(int(value))
+            except ValueError:
+                return str(float(value))
+        elif entry_type == FLOAT:
+            return str(float(value))
+        return value
+    return converter
+
+def first_value(value):
+    """
+    @summary: Returns the first value of a raw INFO value as record.INFO[key][0] in PyVCF
+    @param value: [str/None] The raw value
+    @return: [str/None] The first value (None if missing)
+    """
+    if value is None:
+        return None
+    value = value.split(',', 1)[0]
+    if value in MISSING_VALUES:
+        return None
+    return value
+
+@functools.lru_cache(maxsize=None)
+def prefilter(schema=None):
+    """
+    @summary: Returns the markers searched by the prefilter and the MPA values of the variants without annotation (built once by schema)
+    @param schema: [tuple] The INFO key of each annotation returned by compile_schema (None for the names of ANNOTATION_KEYS)
+    @return: [tuple] The markers (";KEY=") of the scorable annotations, the marker of Func.refGene (None if not available) and the default MPA values
+    """
+    schema = schema or mobidic_mpa.DEFAULT_SCHEMA
+    info_keys = sorted(set(info_key for key, info_key in schema if key != PREFILTER_FUNC_KEY and info_key is not None))
+    func_key = dict(schema)[PREFILTER_FUNC_KEY]
+    annotations = dict((key, None) for key in mobidic_mpa.ANNOTATION_KEYS)
+    annotations[PREFILTER_FUNC_KEY] = 'intergenic'
+    return (tuple(';' + info_key + '=' for info_key in info_keys), None if func_key is None else ';' + func_key + '=',
+        mobidic_mpa.score_annotations(annotations, False))
+
+def is_unscorable(info, schema=None):
+    """
+    @summary: Define from the raw INFO column if the variant has no annotation used by MPA (default MPA values, rank 10 and
+    impact NULL): no predictor, ClinVar, dbscSNV, SpliceAI nor exonic function, and a Func.refGene without splicing.
+    @param info: [str] The INFO column
+    @param schema: [tuple] The INFO key of each annotation returned by compile_schema (None for the names of ANNOTATION_KEYS)
+    @return: [bool] True if the MPA values of the variant are the default ones
+    """
+    markers, func_marker, default_scores = prefilter(schema)
+    if func_marker is None:
+        return False
+    info = ';' + info
+    for marker in markers:
+        position = info.find(marker)
+        while position != -1:
+            # Each occurrence of the key must have a missing first value (".", "" or "NA" as first_value)
+            start = position + len(marker)
+            if not info.startswith(MISSING_PREFIXES, start) and info[start:] not in MISSING_VALUES:
+                return False
+            position = info.find(marker, start)
+    # As parse_info, the last value of a repeated key is used ; a missing Func.refGene is left to the scoring
+    position = info.rfind(func_marker)
+    if position == -1:
+        return False
+    func_value = first_value(info[position + len(func_marker):].split(';', 1)[0])
+    return func_value is not None and not mobidic_mpa.classify_func(func_value).splicing
+
+def is_indel(ref, alt, is_sv):
+    """
+    @summary: Define if the variant is an indel as record.is_indel in PyVCF
+    @param ref: [str] The REF column
+    @param alt: [str] The ALT column (only one allele)
+    @param is_sv: [bool] True if the SVTYPE INFO is defined
+    @return: [bool] True if the variant is an indel
+    """
+    if len(ref) > 1 and not is_sv:
+        return True
+    if alt in MISSING_VALUES:
+        return False
+    if ('[' in alt or ']' in alt or (len(alt) > 1 and (alt[0] == '.' or alt[-1] == '.'))
+            or (alt[0] == '<' and alt[-1] == '>')):
+        return False
+    if len(alt) != len(ref):
+        return not is_sv
+    return False
+
+################################################################################
+#
+# PROCESS
+#
+################################################################################
+def annotate_lines(formatter, lines, vectorized=False, stats=None, trace=False, cache=None, max_rank=None):
+    """
+    @summary: Annotate raw lines of the VCF with MPA score.
+    @param formatter: [RawRecordFormatter] The formatter built from the header of the VCF
+    @param lines: [list] The raw lines (without end of line)
+    @param vectorized: [bool] True to score the variants of the lines together with columnar.score_batch
+    @param stats: [PipelineStats] The time by stage and the counters of the annotation (None to not measure)
+    @param trace: [bool] True to add the trace of the decisions (JSON line) at the end of each tuple
+    @param cache: [ScoreCache] The MPA values of the variants scored by the previous runs (None to score each variant)
+    @param max_rank: [int] The variants with a higher MPA_ranking are not written (None to write all the variants)
+    @return: [list] For each line, the tuple (annotated line, CHROM, POS, REF, END), (None, variant, error message) if the variant is skipped
+    or (False, CHROM, POS, REF, ALT) if the variant is rejected by max_rank
+    """
+    if trace:
+        return _trace_lines(formatter, lines, stats, max_rank)
+    check_split_variants = mobidic_mpa.check_split_variants
+    schema = formatter.schema
+    default_scores = prefilter(schema)[2]
+    default_rejected = max_rank is not None and default_scores['MPA_ranking'] > max_rank
+    clock = time.perf_counter
+    check_seconds = 0.0
+    prefiltered_seconds = 0.0
+    results = []
+    variants = []
+    annotations = []
+    indels = []
+    nb_prefiltered = 0
+    nb_rejected = 0
+
+    start = clock()
+    for line in lines:
+        row = formatter.split(line)
+        checked = clock()
+        try:
+            variant = RawVariant(row[0], row[1], row[3], row[4].split(','))
+            check_split_variants(variant)
+        except SystemExit as e:
+            results.append((None, str(variant), str(e)))
+            check_seconds += clock() - checked
+            continue
+        check_seconds += clock() - checked
+
+        # The variants without annotation get the default MPA values without being parsed nor scored
+        if is_unscorable(row[7], schema):
+            prefiltered = clock()
+            nb_prefiltered += 1
+            if default_rejected:
+                results.append((False, row[0], row[1], row[3], row[4]))
+                nb_rejected += 1
+            else:
+                entries, values = formatter.parse_info(row[7])
+                for key in default_scores:
+                    entries[key] = key + '=' + str(default_scores[key])
+                results.append((formatter.format_record(row, entries), row[0], row[1], row[3], first_value(values.get('END'))))
+            prefiltered_seconds += clock() - prefiltered
+            continue
+
+        entries, values = formatter.parse_info(row[7])
+        annotations.append(dict((key, first_value(values.get(info_key))) for key, info_key in schema))
+        indels.append(is_indel(row[3], row[4], formatter.is_sv(values)))
+        variants.append((len(results), row, entries, first_value(values.get('END'))))
+        results.append(None)
+
+    scored = clock()
+    memo_info = mobidic_mpa.score_signature.cache_info()
+    if cache is not None:
+        keys = [cache.key(row[0], row[1], row[3], row[4], variant_annotations, variant_is_indel)
+            for (position, row, entries, end), variant_annotations, variant_is_indel in zip(variants, annotations, indels)]
+        mpa_scores = cache.get_many(keys)
+        missing = [rank for rank, variant_scores in enumerate(mpa_scores) if variant_scores is None]
+        new_scores = score_lines([annotations[rank] for rank in missing], [indels[rank] for rank in missing], vectorized)
+        for rank, variant_scores in zip(missing, new_scores):
+            mpa_scores[rank] = variant_scores
+        cache.put_many([keys[rank] for rank in missing], new_scores)
+        if stats is not None:
+            stats.count('cached', len(mpa_scores) - len(missing))
+    else:
+        mpa_scores = score_lines(annotations, indels, vectorized)
+
+    formatted = clock()
+    for (position, row, entries, end), variant_scores in zip(variants, mpa_scores):
+        if max_rank is not None and variant_scores['MPA_ranking'] > max_rank:
+            results[position] = (False, row[0], row[1], row[3], row[4])
+            nb_rejected += 1
+            continue
+        for key in variant_scores:
+            entries[key] = key + '=' + str(variant_scores[key])
+        results[position] = (formatter.format_record(row, entries), row[0], row[1], row[3], end)
+
+    if stats is not None:
+        mobidic_mpa.count_memo(stats, memo_info)
+        stats.add('read', scored - start - check_seconds - prefiltered_seconds)
+        stats.add('check', check_seconds)
+        stats.add('score', formatted - scored)
+        stats.add('write', clock() - formatted + prefiltered_seconds)
+        stats.count('records', len(results))
+        stats.count('annotated', len(variants) + nb_prefiltered)
+        stats.count('skipped', len(results) - len(variants) - nb_prefiltered)
+        stats.count('rejected', nb_rejected)
+        stats.count('prefiltered', nb_prefiltered)
+
+    return results
+
+def score_lines(annotations, indels, vectorized=False):
+    """
+    @summary: Returns the MPA values of several variants
+    @param annotations: [list] The annotations of each variant (see score_annotations)
+    @param indels: [list] True for each variant which is an indel
+    @param vectorized: [bool] True to score the variants together with columnar.score_batch
+    @return: [list] The MPA values of each variant
+    """
+    if vectorized:
+        return columnar.score_batch(annotations, indels)
+    score_signature = mobidic_mpa.score_signature
+    annotation_signature = mobidic_mpa.annotation_signature
+    return [score_signature(annotation_signature(variant_annotations), variant_is_indel) for variant_annotations, variant_is_indel in zip(annotations, indels)]
+
+def _trace_lines(formatter, lines, stats=None, max_rank=None):
+    """
+    @summary: Annotate raw lines of the VCF with MPA score one by one and trace the decisions of each variant.
+    @param formatter: [RawRecordFormatter] The formatter built from the header of the VCF
+    @param lines: [list] The raw lines (without end of line)
+    @param stats: [PipelineStats] The time by stage and the counters of the annotation (None to not measure)
+    @param max_rank: [int] The variants with a higher MPA_ranking are not written (None to write all the variants)
+    @return: [list] The results of annotate_lines with the trace (JSON line) at the end of each tuple
+    """
+    check_split_variants = mobidic_mpa.check_split_variants
+    score_annotations = mobidic_mpa.score_annotations
+    format_trace = mobidic_mpa.format_trace
+    schema = formatter.schema
+    clock = time.perf_counter
+    seconds = dict((stage, 0.0) for stage in mpa_stats.STAGES)
+    results = []
+    nb_annotated = 0
+    nb_rejected = 0
+
+    for line in lines:
+        start = clock()
+        row = formatter.split(line)
+        checked = clock()
+        try:
+            variant = RawVariant(row[0], row[1], row[3], row[4].split(','))
+            check_split_variants(variant)
+        except SystemExit as e:
+            results.append((None, str(variant), str(e), format_trace(row[0], row[1], row[3], row[4], error=str(e))))
+            seconds['read'] += checked - start
+            seconds['check'] += clock() - checked
+            continue
+
+        parsed = clock()
+        entries, values = formatter.parse_info(row[7])
+        annotations = dict((key, first_value(values.get(info_key))) for key, info_key in schema)
+        variant_is_indel = is_indel(row[3], row[4], formatter.is_sv(values))
+        scored = clock()
+        decisions = dict()
+        variant_scores = score_annotations(annotations, variant_is_indel, decisions)
+        formatted = clock()
+        variant_trace = format_trace(row[0], row[1], row[3], row[4], variant_is_indel, variant_scores, decisions)
+        nb_annotated += 1
+        if max_rank is not None and variant_scores['MPA_ranking'] > max_rank:
+            results.append((False, row[0], row[1], row[3], row[4], variant_trace))
+            nb_rejected += 1
+        else:
+            for key in variant_scores:
+                entries[key] = key + '=' + str(variant_scores[key])
+            results.append((formatter.format_record(row, entries), row[0], row[1], row[3], first_value(values.get('END')), variant_trace))
+        seconds['read'] += checked - start + scored - parsed
+        seconds['check'] += parsed - checked
+        seconds['score'] += formatted - scored
+        seconds['write'] += clock() - formatted
+
+    if stats is not None:
+        for stage in seconds:
+            stats.add(stage, seconds[stage])
+        stats.count('records', len(results))
+        stats.count('annotated', nb_annotated)
+        stats.count('skipped', len(results) - nb_annotated)
+        stats.count('rejected', nb_rejected)
+
+    return results
+
+def write_results(results, stream, log, stats=None, trace_stream=None, rejected_stream=None):
+    """
+    @summary: Write the annotated lines in the output (and add them in its index) ; log the skipped variants.
+    @param results: [list] The results of annotate_lines
+    @param stream: [file] The output stream (BgzfWriter when the output is compressed)
+    @param log: [Logger] The logger of the script.
+    @param stats: [PipelineStats] The time by stage and the counters of the annotation (None to not measure)
+    @param trace_stream: [file] The stream of the decisions of each variant (None if the results are not traced)
+    @param rejected_stream: [file] The stream of the coordinates of the variants rejected by max_rank (None to not write them)
+    @return: [None]
+    """
+    start = time.perf_counter()
+    index = getattr(stream, 'index', None)
+    write = stream.write
+    if trace_stream is not None:
+        trace_stream.writelines(result[-1] for result in results)
+    for result in results:
+        if result[0] is None:
+            log.error(result[1])
+            log.error(result[2])
+        elif result[0] is False:
+            if rejected_stream is not None:
+                rejected_stream.write('\t'.join(result[1:5]) + '\n')
+        elif index is None:
+            write(result[0])
+        else:
+            offset = stream.tell()
+            write(result[0])
+            index.add_record(result[1], result[2], result[3], result[4], offset, stream.tell())
+    if stats is not None:
+        stats.add('write', time.perf_counter() - start)
+    return None
+
+def read_chunks(lines, chunk_size=CHUNK_SIZE):
+    """
+    @summary: Group the lines of the VCF in chunks
+    @param lines: [iterator] The raw lines
+    @param chunk_size: [int] The number of lines by chunk
+    @return: [generator] The lists of lines
+    """
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _init_worker(header, raw_samples, vectorized, trace, cache_file, cache_size, max_rank, annotations_only, schema, table_keys, logger_name, logger_level):
+    """
+    @summary: Prepare a worker process: build the formatter from the header of the annotated VCF
+    @param header: [str] The header of the annotated VCF (MPA INFO declared)
+    @param raw_samples: [bool] True to copy the FORMAT and sample columns without parsing them
+    @param vectorized: [bool] True to score the chunks with columnar.score_batch
+    @param trace: [bool] True to trace the decisions of each variant
+    @param cache_file: [str] Path of the cache of the scores (None to score each variant)
+    @param cache_size: [int] The maximum number of variants kept in the cache
+    @param max_rank: [int] The variants with a higher MPA_ranking are not written (None to write all the variants)
+    @param annotations_only: [bool] True to write only CHROM, POS, ID, REF, ALT and the MPA INFO of the variants
+    @param schema: [tuple] The INFO key of each annotation returned by compile_schema (None for the names of ANNOTATION_KEYS)
+    @param table_keys: [list] When only the table is written, the INFO of the table (None to write the VCF)
+    @param logger_name: [str] The name of the logger of the script
+    @param logger_level: [int] The level of the logger of the script
+    @return: [None]
+    """
+    global worker_formatter, worker_vectorized, worker_trace, worker_cache, worker_max_rank
+    log = logging.getLogger(logger_name)
+    log.setLevel(logger_level)
+    mobidic_mpa.log = log
+    vcf_reader = vcf.Reader(io.StringIO(header), compressed=False)
+    worker_formatter = RawRecordFormatter(vcf_reader, raw_samples, annotations_only, schema, table_keys)
+    worker_vectorized = vectorized
+    worker_trace = trace
+    worker_max_rank = max_rank
+    worker_cache = None
+    if cache_file is not None:
+        worker_cache = scorecache.ScoreCache(cache_file, cache_size)
+        # The last uses and scores are written when the worker exits (after pool.close)
+        multiprocessing.util.Finalize(worker_cache, worker_cache.close, exitpriority=10)
+    return None
+
+def _annotate_chunk(lines):
+    """
+    @summary: Annotate a chunk of lines in a worker process
+    @param lines: [list] The raw lines
+    @return: [tuple] The results of annotate_lines and the values of the stats of the chunk
+    """
+    stats = mpa_stats.PipelineStats()
+    return (annotate_lines(worker_formatter, lines, worker_vectorized, stats, worker_trace, worker_cache, worker_max_rank), stats.values())
+
+def _put(items, item, stop):
+    """
+    @summary: Add an item in a bounded queue of the pipeline (waits while the queue is full)
+    @param items: [queue.Queue] The queue
+    @param item: [object] The item
+    @param stop: [threading.Event] Set when the pipeline is interrupted
+    @return: [bool] True if the item is added ; False if the pipeline is interrupted
+    """
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _get(items, stop):
+    """
+    @summary: Remove the next item of a queue of the pipeline (waits while the queue is empty)
+    @param items: [queue.Queue] The queue
+    @param stop: [threading.Event] Set when the pipeline is interrupted
+    @return: [object] The item ; None at the end of the queue or if the pipeline is interrupted
+    """
+    while not stop.is_set():
+        try:
+            return items.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return None
+
+def annotate_pipelined(formatter, chunks, stream, log, vectorized=False, stats=None, trace_stream=None, cache=None, max_rank=None,
+        rejected_stream=None):
+    """
+    @summary: Annotate the chunks with three threads: the reader, the scoring (current thread) and the writer are connected by
+    bounded queues, so the reading and the decompression of the input and the compression of the output overlap the scoring.
+    The memory is limited to PIPELINE_QUEUE_SIZE chunks by queue.
+    @param formatter: [RawRecordFormatter] The formatter built from the header of the VCF
+    @param chunks: [iterator] The lists of raw lines (see read_chunks)
+    @param stream: [file] The output stream (BgzfWriter when the output is compressed)
+    @param log: [Logger] The logger of the script.
+    @param vectorized: [bool] True to score each chunk of variants with array operations (columnar.score_batch)
+    @param stats: [PipelineStats] The time by stage and the counters of the annotation (None to not measure)
+    @param trace_stream: [file] The stream of the decisions of each variant (None to not trace)
+    @param cache: [ScoreCache] The MPA values of the variants scored by the previous runs (None to score each variant)
+    @param max_rank: [int] The variants with a higher MPA_ranking are not written (None to write all the variants)
+    @param rejected_stream: [file] The stream of the coordinates of the variants rejected by max_rank (None to not write them)
+    @return: [None]
+    """
+    # Each thread has its own stats, merged at the end
+    read_stats = mpa_stats.PipelineStats()
+    write_stats = mpa_stats.PipelineStats()
+    chunk_queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+    result_queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+    stop = threading.Event()
+    errors = []
+
+    def read_stage():
+        try:
+            for chunk in read_stats.timed(chunks, 'read'):
+                if not _put(chunk_queue, chunk, stop):
+                    return None
+        except BaseException as e:
+            errors.append(e)
+        _put(chunk_queue, None, stop)
+
+    def write_stage():
+        try:
+            while True:
+                results = _get(result_queue, stop)
+                if results is None:
+                    return None
+                write_results(results, stream, log, write_stats, trace_stream, rejected_stream)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    reader = threading.Thread(target=read_stage, name='mpa-reader', daemon=True)
+    writer = threading.Thread(target=write_stage, name='mpa-writer', daemon=True)
+    reader.start()
+    writer.start()
+    try:
+        while True:
+            chunk = _get(chunk_queue, stop)
+            if chunk is None:
+                break
+            if not _put(result_queue, annotate_lines(formatter, chunk, vectorized, stats, trace_stream is not None, cache, max_rank), stop):
+                break
+        # The writer ends once the pending results are written
+        _put(result_queue, None, stop)
+        writer.join()
+    finally:
+        stop.set()
+        reader.join()
+        writer.join()
+    if errors:
+        raise errors[0]
+    if stats is not None:
+        stats.merge(read_stats.values())
+        stats.merge(write_stats.values())
+    return None
+
+def annotate(vcf_reader, vcf_writer, log, raw_samples=False, threads=1, lines=None, vectorized=False, stats=None, trace_stream=None, cache=None,
+        max_rank=None, rejected_stream=None, annotations_only=False, schema=None, pipelined=False, table_keys=None):
+    """
+    @summary: Annotate the variants with MPA score from the raw lines of the VCF.
+    @param vcf_reader: [vcf.Reader] The reader of the VCF (header already parsed, MPA INFO already declared)
+    @param vcf_writer: [vcf.Writer] The writer of the annotated VCF (header already written)
+    @param log: [Logger] The logger of the script.
+    @param raw_samples: [bool] True to copy the FORMAT and sample columns without parsing them
+    @param threads: [int] The number of processes used to score the chunks of variants
+    @param lines: [iterator] The raw lines to annotate (all the lines of vcf_reader if None)
+    @param vectorized: [bool] True to score each chunk of variants with array operations (columnar.score_batch)
+    @param stats: [PipelineStats] The time by stage and the counters of the annotation
+    @param trace_stream: [file] The stream of the decisions of each variant (None to not trace)
+    @param cache: [ScoreCache] The MPA values of the variants scored by the previous runs (None to score each variant)
+    @param max_rank: [int] The variants with a higher MPA_ranking are not written (None to write all the variants)
+    @param rejected_stream: [file] The stream of the coordinates of the variants rejected by max_rank (None to not write them)
+    @param annotations_only: [bool] True to write only CHROM, POS, ID, REF, ALT and the MPA INFO of the variants
+    @param schema: [tuple] The INFO key of each annotation returned by compile_schema (None for the names of ANNOTATION_KEYS)
+    @param pipelined: [bool] True to read, score and write the chunks in three threads (see annotate_pipelined ; with one process)
+    @param table_keys: [list] When only the table is written, the INFO of the table: the rows are written in the stream of vcf_writer
+    instead of the lines (None to write the VCF)
+    @return: [None]
+    """
+    trace = trace_stream is not None
+    if stats is None:
+        stats = mpa_stats.PipelineStats()
+    stream = vcf_writer.stream
+    if lines is None:
+        lines = vcf_reader.reader
+    chunks = stats.timed(read_chunks(lines), 'read')
+
+    if threads <= 1:
+        formatter = RawRecordFormatter(vcf_reader, raw_samples, annotations_only, schema, table_keys)
+        if pipelined:
+            annotate_pipelined(formatter, read_chunks(lines), stream, log, vectorized, stats, trace_stream, cache, max_rank, rejected_stream)
+            return None
+        for chunk in chunks:
+            write_results(annotate_lines(formatter, chunk, vectorized, stats, trace, cache, max_rank), stream, log, stats, trace_stream, rejected_stream)
+        return None
+
+    # Header of the annotated VCF used by the workers to rebuild the formatter
+    header = io.StringIO()
+    vcf.Writer(header, vcf_reader)
+
+    # The chunks are written in input order ; at most 2 chunks by process are pending
+    def write_chunk(result):
+        results, values = result.get()
+        stats.merge(values)
+        write_results(results, stream, log, stats, trace_stream, rejected_stream)
+
+    pool = multiprocessing.Pool(threads, _init_worker, (header.getvalue(), raw_samples, vectorized, trace,
+        None if cache is None else cache.filename, None if cache is None else cache.max_entries, max_rank, annotations_only, schema, table_keys, log.name, log.getEffectiveLevel()))
+    try:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_annotate_chunk, (chunk,)))
+            if len(pending) >= 2 * threads:
+                write_chunk(pending.popleft())
+        while pending:
+            write_chunk(pending.popleft())
+        # The workers exit normally: their caches are closed
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return None
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+__author__ = 'Mobidic'
+__authors__ = ['Henri Pegeot','Kevin Yauy','Charles Van Goethem','David Baux']
+__copyright__ = 'Copyright (C) 2019'
+__license__ = 'Academic License Agreement'
+__version__ = '1.1.2'
+__email__ = 'h-pegeot@chu-montpellier.fr'
+__status__ = 'prod'
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import os         # os command
+import bisect     # search in sorted regions
+import gzip       # read compressed index
+import struct     # binary format of index
+
+from mobidic_mpa import bgzf
+
+################################################################################
+#
+# CONSTANTS
+#
+################################################################################
+# Maximum position handled by the index
+MAX_POSITION = 1 << 62
+
+################################################################################
+#
+# CLASS
+#
+################################################################################
+class IndexReader(object):
+    """
+    @summary: Tabix index (.tbi or .csi) of a BGZF compressed VCF.
+    """
+    def __init__(self, filename):
+        """
+        @param filename: [str] Path of the index
+        """
+        self.filename = filename
+        with gzip.open(filename, 'rb') as handle:
+            data = handle.read()
+
+        if data[:4] == b'TBI\x01':
+            self.min_shift = bgzf.TBI_MIN_SHIFT
+            self.depth = bgzf.TBI_DEPTH
+            nb_references = struct.unpack_from('<i', data, 4)[0]
+            position = self._read_names(data, 8)
+            has_linear = True
+        elif data[:4] == b'CSI\x01':
+            self.min_shift, self.depth, aux_size = struct.unpack_from('<3i', data, 4)
+            self._read_names(data, 16)
+            position = 16 + aux_size
+            nb_references = struct.unpack_from('<i', data, position)[0]
+            position += 4
+            has_linear = False
+        else:
+            raise Exception("The file {} is not a tabix index.".format(filename))
+
+        pseudo_bin = ((1 << (3 * (self.depth + 1))) - 1) // 7 + 1
+        self.references = []
+        for _ in range(nb_references):
+            bins = dict()
+            loffsets = dict()
+            nb_bins = struct.unpack_from('<i', data, position)[0]
+            position += 4
+            for _ in range(nb_bins):
+                if has_linear:
+                    bin_id, nb_chunks = struct.unpack_from('<Ii', data, position)
+                    position += 8
+                else:
+                    bin_id, loffset, nb_chunks = struct.unpack_from('<IQi', data, position)
+                    position += 16
+                    loffsets[bin_id] = loffset
+                chunks = list(struct.unpack_from('<' + 'QQ' * nb_chunks, data, position))
+                position += 16 * nb_chunks
+                if bin_id != pseudo_bin:
+                    bins[bin_id] = list(zip(chunks[::2], chunks[1::2]))
+            linear = []
+            if has_linear:
+                nb_windows = struct.unpack_from('<i', data, position)[0]
+                position += 4
+                linear = list(struct.unpack_from('<' + 'Q' * nb_windows, data, position))
+                position += 8 * nb_windows
+            self.references.append((bins, linear, loffsets))
+
+    def _read_names(self, data, position):
+        """
+        @summary: Read the tabix header (configuration and names of the sequences)
+        @param data: [bytes] The uncompressed index
+        @param position: [int] The position of the tabix header
+        @return: [int] The position after the tabix header
+        """
+        names_size = struct.unpack_from('<i', data, position + 24)[0]
+        names = data[position + 28:position + 28 + names_size]
+        self.names = [name.decode('utf-8') for name in names.split(b'\x00')[:-1]]
+        return position + 28 + names_size
+
+    def chunks(self, chrom, beg, end):
+        """
+        @summary: Returns the chunks of the compressed file that may contain records overlapping a region
+        @param chrom: [str] The chromosome
+        @param beg: [int] The 0-based start of the region
+        @param end: [int] The 0-based end (excluded) of the region
+        @return: [list] The sorted and merged chunks (start and end virtual offsets)
+        """
+        if chrom not in self.names:
+            return []
+        bins, linear, loffsets = self.references[self.names.index(chrom)]
+        beg = max(beg, 0)
+        end = min(end, 1 << (self.min_shift + 3 * self.depth))
+        if end <= beg:
+            return []
+
+        # Records before min_offset end before the region
+        min_offset = 0
+        if linear:
+            window = beg >> self.min_shift
+            min_offset = linear[min(window, len(linear) - 1)]
+        else:
+            bin_id = bgzf.reg2bin(beg, beg + 1, self.min_shift, self.depth)
+            while bin_id and bin_id not in loffsets:
+                bin_id = (bin_id - 1) >> 3
+            min_offset = loffsets.get(bin_id, 0)
+
+        chunks = []
+        for bin_id in reg2bins(beg, end, self.min_shift, self.depth):
+            for chunk in bins.get(bin_id, []):
+                if chunk[1] > min_offset:
+                    chunks.append(chunk)
+        return merge_chunks(chunks)
+
+################################################################################
+#
+# FUNCTIONS
+#
+################################################################################
+def reg2bins(beg, end, min_shift, depth):
+    """
+    @summary: Returns the bins overlapping an interval in the binning scheme of htslib
+    @param beg: [int] The 0-based start
+    @param end: [int] The 0-based end (excluded)
+    @param min_shift: [int] The size of the smallest bins (1 << min_shift)
+    @param depth: [int] The number of levels
+    @return: [list] The bins
+    """
+    bins = []
+    end -= 1
+    shift = min_shift + 3 * depth
+    first = 0
+    for level in range(depth + 1):
+        bins.extend(range(first + (beg >> shift), first + (end >> shift) + 1))
+        shift -= 3
+        first += 1 << (level * 3)
+    return bins
+
+def merge_chunks(chunks):
+    """
+    @summary: Sort and merge overlapping chunks
+    @param chunks: [list] The chunks (start and end virtual offsets)
+    @return: [list] The merged chunks
+    """
+    merged = []
+    for start, end in sorted(chunks):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def parse_region(region):
+    """
+    @summary: Parse a region written as "chr", "chr:start" or "chr:start-end" (1-based, end included)
+    @param region: [str] The region
+    @return: [tuple] The chromosome, the 0-based start and the 0-based end (excluded)
+    """
+    chrom, sep, interval = region.rpartition(':')
+    if not sep or not interval.replace(',', '').replace('-', '').isdigit():
+        return region, 0, MAX_POSITION
+    start, sep, end = interval.replace(',', '').partition('-')
+    beg = max(int(start) - 1, 0)
+    if end:
+        return chrom, beg, int(end)
+    return chrom, beg, MAX_POSITION
+
+def read_bed(filename):
+    """
+    @summary: Read the regions of a BED file (0-based start, end excluded)
+    @param filename: [str] Path of the BED file (gzip compressed if the name ends with ".gz")
+    @return: [list] The tuples (chromosome, start, end)
+    """
+    regions = []
+    with bgzf.open_input(filename) as handle:
+        for line_number, line in enumerate(handle, 1):
+            if not line.strip() or line.startswith(('#', 'track', 'browser')):
+                continue
+            columns = line.rstrip('\r\n').split('\t')
+            if len(columns) < 3 or not columns[1].isdigit() or not columns[2].isdigit():
+                raise ValueError("Line {} of the BED {} must contain a chromosome, a start and an end: {}".format(line_number, filename, line.rstrip('\r\n')))
+            regions.append((columns[0], int(columns[1]), int(columns[2])))
+    return regions
+
+def merge_regions(regions):
+    """
+    @summary: Sort and merge overlapping regions by chromosome
+    @param regions: [list] The tuples (chromosome, start, end)
+    @return: [dict] The sorted list of [start, end] by chromosome
+    """
+    merged = dict()
+    for chrom, beg, end in sorted(regions):
+        intervals = merged.setdefault(chrom, [])
+        if intervals and beg <= intervals[-1][1]:
+            intervals[-1][1] = max(intervals[-1][1], end)
+        else:
+            intervals.append([beg, end])
+    return merged
+
+def find_index(filename):
+    """
+    @summary: Returns the path of the index of a compressed VCF (.tbi or .csi)
+    @param filename: [str] Path of the compressed VCF
+    @return: [str/None] The path of the index or None if not found
+    """
+    for extension in ('.tbi', '.csi'):
+        if os.path.exists(filename + extension):
+            return filename + extension
+    return None
+
+def record_interval(line):
+    """
+    @summary: Returns the interval of a VCF line as tabix -p vcf (REF length or END INFO)
+    @param line: [str] The raw line
+    @return: [tuple] The chromosome, the 0-based start and the 0-based end (excluded)
+    """
+    columns = line.split('\t', 8)
+    beg = int(columns[1]) - 1
+    end = beg + len(columns[3])
+    for entry in columns[7].split(';'):
+        if entry.startswith('END='):
+            try:
+                end = int(entry[4:])
+            except ValueError:
+                pass
+            break
+    return columns[0], beg, max(end, beg + 1)
+
+def fetch_lines(filename, regions):
+    """
+    @summary: Read the lines of a compressed and indexed VCF overlapping the regions (in file order, each line only once)
+    @param filename: [str] Path of the compressed VCF
+    @param regions: [list] The tuples (chromosome, start, end) with 0-based start and end excluded
+    @return: [generator] The lines without end of line
+    """
+    index = IndexReader(find_index(filename))
+    merged = merge_regions(regions)
+    reader = bgzf.BgzfReader(filename)
+    try:
+        for chrom in index.names:
+            if chrom not in merged:
+                continue
+            intervals = merged[chrom]
+            starts = [interval[0] for interval in intervals]
+            chunks = []
+            for beg, end in intervals:
+                chunks.extend(index.chunks(chrom, beg, end))
+            for start_offset, end_offset in merge_chunks(chunks):
+                for offset, line in reader.lines(start_offset, end_offset):
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    record_chrom, record_beg, record_end = record_interval(line)
+                    if record_chrom != chrom:
+                        continue
+                    # Last region starting before the end of the record (regions are sorted and disjoint)
+                    position = bisect.bisect_left(starts, record_end) - 1
+                    if position >= 0 and intervals[position][1] > record_beg:
+                        yield line
+    finally:
+        reader.close()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+__author__ = 'Mobidic'
+__authors__ = ['Henri Pegeot','Kevin Yauy','Charles Van Goethem','David Baux']
+__copyright__ = 'Copyright (C) 2019'
+__license__ = 'Academic License Agreement'
+__version__ = '1.1.2'
+__email__ = 'h-pegeot@chu-montpellier.fr'
+__status__ = 'prod'
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import json       # stored scores
+import sqlite3    # cache file
+import hashlib    # fingerprint of the annotations
+
+import mobidic_mpa
+
+################################################################################
+#
+# CONSTANTS
+#
+################################################################################
+# Default maximum number of variants kept in the cache
+DEFAULT_MAX_ENTRIES = 1000000
+
+# Number of scores kept in memory before being written in the cache file
+FLUSH_SIZE = 1000
+
+# Maximum number of variants searched by query
+QUERY_SIZE = 500
+
+# Seconds to wait for the lock of the cache file (written by several processes)
+LOCK_TIMEOUT = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    key BLOB PRIMARY KEY,
+    version TEXT NOT NULL,
+    scores TEXT NOT NULL,
+    last_used INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used);
+"""
+
+################################################################################
+#
+# CLASS
+#
+################################################################################
+class ScoreCache(object):
+    """
+    @summary: MPA values of the variants already scored, stored in a SQLite file shared by the runs. A variant is
+    found by the digest of its CHROM/POS/REF/ALT, of its annotations and of the version of MPA. When the cache is
+    full, the variants used the least recently are removed.
+    """
+    def __init__(self, filename, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        @param filename: [str] Path of the cache file (created if it does not exist)
+        @param max_entries: [int] The maximum number of variants kept in the cache
+        """
+        self.filename = filename
+        self.max_entries = max_entries
+        self.version = mobidic_mpa.__version__
+        self.hits = 0
+        self.misses = 0
+        self.pending = []
+        self.touched = []
+        self.connection = sqlite3.connect(filename, timeout=LOCK_TIMEOUT)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+            # The scores of another version of MPA are never used
+            self.connection.execute("DELETE FROM scores WHERE version != ?", (self.version,))
+        self.nb_entries = self.connection.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+
+    def key(self, chrom, pos, ref, alt, annotations, is_indel):
+        """
+        @summary: Returns the key of a variant in the cache
+        @param chrom: [str] The chromosome
+        @param pos: [int] The position
+        @param ref: [str] The reference allele
+        @param alt: [str] The alternative alleles (separated by comma)
+        @param annotations: [dict] The first value of each annotation listed in ANNOTATION_KEYS (None if not available)
+        @param is_indel: [bool] Boolean to define if variants is indel or not
+        @return: [bytes] The key
+        """
+        values = [self.version, chrom, str(int(pos)), ref, alt, "1" if is_indel else "0"]
+        values.extend("\x00" if annotations[key] is None else str(annotations[key]) for key in mobidic_mpa.ANNOTATION_KEYS)
+        return hashlib.blake2b("\x1f".join(values).encode('utf-8'), digest_size=16).digest()
+
+    def get(self, key):
+        """
+        @summary: Returns the MPA values of a variant
+        @param key: [bytes] The key of the variant (see key())
+        @return: [dict] The MPA values (keys from MPA_KEYS) ; None if the variant is not in the cache
+        """
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        """
+        @summary: Returns the MPA values of several variants
+        @param keys: [list] The keys of the variants (see key())
+        @return: [list] The MPA values of each variant (None if the variant is not in the cache)
+        """
+        found = dict()
+        for start in range(0, len(keys), QUERY_SIZE):
+            block = keys[start:start + QUERY_SIZE]
+            found.update(self.connection.execute(
+                "SELECT key, scores FROM scores WHERE key IN (" + ",".join("?" * len(block)) + ")", block
+            ))
+        self.touched.extend(found)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        if len(self.touched) >= FLUSH_SIZE:
+            self.flush()
+        return [json.loads(found[key]) if key in found else None for key in keys]
+
+    def put(self, key, mpa_scores):
+        """
+        @summary: Add the MPA values of a variant (written in the cache file by blocks)
+        @param key: [bytes] The key of the variant (see key())
+        @param mpa_scores: [dict] The MPA values returned by score_annotations
+        @return: [None]
+        """
+        self.pending.append((key, self.version, json.dumps(mpa_scores)))
+        if len(self.pending) >= FLUSH_SIZE:
+            self.flush()
+        return None
+
+    def put_many(self, keys, mpa_scores):
+        """
+        @summary: Add the MPA values of several variants and write them in the cache file
+        @param keys: [list] The keys of the variants (see key())
+        @param mpa_scores: [list] The MPA values of each variant
+        @return: [None]
+        """
+        for key, variant_scores in zip(keys, mpa_scores):
+            self.pending.append((key, self.version, json.dumps(variant_scores)))
+        self.flush()
+        return None
+
+    def flush(self):
+        """
+        @summary: Write the new MPA values and the last use of the variants found in the cache file ; remove the
+        variants used the least recently when the cache is full
+        @return: [None]
+        """
+        if not self.pending and not self.touched:
+            return None
+        with self.connection:
+            # Each write of the cache file is a new use
+            now = self.connection.execute("SELECT COALESCE(MAX(last_used), 0) + 1 FROM scores").fetchone()[0]
+            if self.touched:
+                self.connection.executemany("UPDATE scores SET last_used = ? WHERE key = ?", ((now, key) for key in self.touched))
+            if self.pending:
+                cursor = self.connection.executemany(
+                    "INSERT OR IGNORE INTO scores (key, version, scores, last_used) VALUES (?, ?, ?, " + str(now) + ")",
+                    self.pending
+                )
+                self.nb_entries += max(cursor.rowcount, 0)
+            if self.nb_entries > self.max_entries:
+                # Other processes may have written in the cache
+                self.nb_entries = self.connection.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+                if self.nb_entries > self.max_entries:
+                    self.connection.execute(
+                        "DELETE FROM scores WHERE key IN (SELECT key FROM scores ORDER BY last_used LIMIT ?)",
+                        (self.nb_entries - self.max_entries,)
+                    )
+                    self.nb_entries = self.max_entries
+        self.pending = []
+        self.touched = []
+        return None
+
+    def close(self):
+        """
+        @summary: Write the pending MPA values and close the cache file
+        @return: [None]
+        """
+        self.flush()
+        self.connection.close()
+        return None
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+__author__ = 'Mobidic'
+__authors__ = ['Henri Pegeot','Kevin Yauy','Charles Van Goethem','David Baux']
+__copyright__ = 'Copyright (C) 2019'
+__license__ = 'Academic License Agreement'
+__version__ = '1.1.2'
+__email__ = 'h-pegeot@chu-montpellier.fr'
+__status__ = 'prod'
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import functools  # memo of the scores
+import collections
+
+import mobidic_mpa
+
+################################################################################
+#
+# CONSTANTS
+#
+################################################################################
+# Default maximum number of distinct annotations kept with their MPA values by a Scorer
+DEFAULT_MEMO_SIZE = 65536
+
+################################################################################
+#
+# CLASS
+#
+################################################################################
+class MPAResult(collections.namedtuple('MPAResult', ['impact', 'ranking', 'final_score', 'adjusted', 'available', 'deleterious'])):
+    """
+    @summary: The MPA values of one variant.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_scores(cls, mpa_scores):
+        """
+        @summary: Returns the result from the MPA values returned by score_annotations
+        @param mpa_scores: [dict] The MPA values (keys from MPA_KEYS)
+        @return: [MPAResult] The result
+        """
+        return cls(
+            impact=mpa_scores['MPA_impact'],
+            ranking=mpa_scores['MPA_ranking'],
+            final_score=mpa_scores['MPA_final_score'],
+            adjusted=mpa_scores['MPA_adjusted'],
+            available=mpa_scores['MPA_available'],
+            deleterious=mpa_scores['MPA_deleterious']
+        )
+
+    def info(self):
+        """
+        @summary: Returns the MPA values as the INFO added in the VCF
+        @return: [dict] The MPA values (keys from MPA_KEYS)
+        """
+        return dict(('MPA_' + field, value) for field, value in zip(self._fields, self))
+
+
+class Scorer(object):
+    """
+    @summary: Computes the MPA values of variants from plain mappings of their ANNOVAR annotations, without files and
+    without global state: each scorer has its own memo and several scorers can be used by concurrent threads.
+    """
+    def __init__(self, memo_size=DEFAULT_MEMO_SIZE, vectorized=False):
+        """
+        @param memo_size: [int] The maximum number of distinct annotations kept with their MPA values (0 to not memoize)
+        @param vectorized: [bool] True to score the variants of score_many together with array operations (needs numpy)
+        """
+        if vectorized and mobidic_mpa.columnar.numpy is None:
+            raise ImportError("The vectorized scoring needs the python package numpy (pip install numpy)")
+        self.vectorized = vectorized
+        self._score_signature = self._compute
+        if memo_size:
+            self._score_signature = functools.lru_cache(maxsize=memo_size)(self._compute)
+
+    @staticmethod
+    def _compute(signature, is_indel):
+        return mobidic_mpa.score_annotations(dict(zip(mobidic_mpa.ANNOTATION_KEYS, signature)), is_indel)
+
+    @staticmethod
+    def normalize(annotations):
+        """
+        @summary: Returns the annotations read by MPA as in a VCF record (first value, None if missing)
+        @param annotations: [mapping] The annotations by INFO key (missing keys, ".", "" and None are not available)
+        @return: [dict] The first value of each annotation listed in ANNOTATION_KEYS (None if not available)
+        """
+        normalized = dict()
+        for key in mobidic_mpa.ANNOTATION_KEYS:
+            value = annotations.get(key)
+            if isinstance(value, (list, tuple)):
+                value = value[0] if value else None
+            if isinstance(value, str):
+                value = mobidic_mpa.rawvcf.first_value(value)
+            normalized[key] = value
+        return normalized
+
+    @staticmethod
+    def variant_is_indel(annotations, is_indel=None):
+        """
+        @summary: Returns if the variant is an indel: is_indel if given, else from the REF and ALT of the mapping
+        @param annotations: [mapping] The annotations by INFO key (with optional REF and ALT)
+        @param is_indel: [bool] Boolean to define if variants is indel or not (None to use REF and ALT)
+        @return: [bool] True if the variant is an indel
+        """
+        if is_indel is not None:
+            return bool(is_indel)
+        if annotations.get('REF') and annotations.get('ALT'):
+            return mobidic_mpa.rawvcf.is_indel(annotations['REF'], annotations['ALT'], annotations.get('SVTYPE') is not None)
+        return False
+
+    def score(self, annotations, is_indel=None):
+        """
+        @summary: Compute the MPA values of one variant
+        @param annotations: [mapping] The annotations by INFO key (see normalize ; a missing Func.refGene is neither exonic
+        nor splicing) ; REF and ALT are used when is_indel is None
+        @param is_indel: [bool] Boolean to define if variants is indel or not (None to use REF and ALT of the mapping)
+        @return: [MPAResult] The MPA values
+        """
+        normalized = self.normalize(annotations)
+        signature = mobidic_mpa.annotation_signature(normalized)
+        return MPAResult.from_scores(self._score_signature(signature, self.variant_is_indel(annotations, is_indel)))
+
+    def score_many(self, variants):
+        """
+        @summary: Compute the MPA values of several variants
+        @param variants: [iterable] The annotations of each variant (see score), or the tuples (annotations, is_indel)
+        @return: [list] The MPAResult of each variant
+        """
+        annotations = []
+        indels = []
+        for variant in variants:
+            variant_is_indel = None
+            if isinstance(variant, tuple):
+                variant, variant_is_indel = variant
+            annotations.append(self.normalize(variant))
+            indels.append(self.variant_is_indel(variant, variant_is_indel))
+        if self.vectorized:
+            mpa_scores = mobidic_mpa.columnar.score_batch(annotations, indels)
+        else:
+            annotation_signature = mobidic_mpa.annotation_signature
+            mpa_scores = [self._score_signature(annotation_signature(variant_annotations), variant_is_indel)
+                for variant_annotations, variant_is_indel in zip(annotations, indels)]
+        return [MPAResult.from_scores(variant_scores) for variant_scores in mpa_scores]
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+__author__ = 'Mobidic'
+__authors__ = ['Henri Pegeot','Kevin Yauy','Charles Van Goethem','David Baux']
+__copyright__ = 'Copyright (C) 2019'
+__license__ = 'Academic License Agreement'
+__version__ = '1.1.2'
+__email__ = 'h-pegeot@chu-montpellier.fr'
+__status__ = 'prod'
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import re         # regex
+import heapq      # best variants and merge of the sorted runs
+import tempfile   # sorted runs
+
+################################################################################
+#
+# CONSTANTS
+#
+################################################################################
+MPA_RANKING_PATTERN = re.compile('[\t;]MPA_ranking=([^;\t]+)')
+MPA_FINAL_SCORE_PATTERN = re.compile('[\t;]MPA_final_score=([^;\t]+)')
+END_PATTERN = re.compile('[\t;]END=([^;\t,]+)')
+
+# Default size of the records sorted in memory before being written in a temporary file (MB)
+DEFAULT_SORT_BUFFER = 256
+
+# Maximum number of sorted runs opened together (beyond, the runs are merged in one run)
+MAX_RUNS = 64
+
+# Header lines kept in the annotation-only output
+ANNOTATION_HEADER_PREFIXES = ('##fileformat=', '##reference=', '##contig=', '##INFO=<ID=MPA_')
+
+################################################################################
+#
+# CLASS
+#
+################################################################################
+class SelectedOutput(object):
+    """
+    @summary: Text stream placed between the VCF writers and the output: the header lines are written directly, the
+    annotated records are given to select() and written by write_record() (which adds them in the index of the output).
+    """
+    def __init__(self, stream):
+        """
+        @param stream: [file] The output stream (BgzfWriter when the output is compressed)
+        """
+        self.stream = stream
+        self.name = getattr(stream, 'name', None)
+        # The index of the output is only exposed once the selected records are written (see close)
+        self._index = getattr(stream, 'index', None)
+
+    def write(self, text):
+        """
+        @summary: Write a header line or select an annotated record
+        @param text: [str] One line of the VCF (with end of line)
+        @return: [None]
+        """
+        if text.startswith('#'):
+            self.stream.write(text)
+        else:
+            self.select(text)
+
+    def select(self, line):
+        """
+        @summary: Keep, write or drop an annotated record
+        @param line: [str] The annotated record (with end of line)
+        @return: [None]
+        """
+        self.write_record(line)
+
+    def write_record(self, line):
+        """
+        @summary: Write an annotated record in the output (and add it in its index)
+        @param line: [str] The annotated record (with end of line)
+        @return: [None]
+        """
+        if self._index is None:
+            self.stream.write(line)
+            return None
+        columns = line.split('\t', 8)
+        match = END_PATTERN.search('\t' + columns[7])
+        offset = self.stream.tell()
+        self.stream.write(line)
+        self._index.add_record(columns[0], columns[1], columns[3], match.group(1) if match else None, offset, self.stream.tell())
+        return None
+
+    def finish(self):
+        """
+        @summary: Write the records kept until the end of the annotation
+        @return: [None]
+        """
+        return None
+
+    def flush(self):
+        """
+        @summary: Flush the output (the records kept are written by close)
+        @return: [None]
+        """
+        self.stream.flush()
+
+    def close(self):
+        """
+        @summary: Write the records kept, then close the output
+        @return: [None]
+        """
+        self.finish()
+        self.index = self._index
+        self.stream.close()
+        return None
+
+
+class TopKOutput(SelectedOutput):
+    """
+    @summary: Keeps only the best annotated records (MPA_ranking ascending then MPA_final_score descending, the first
+    in the input for equal values) in a heap of k records, written in the input order at the end.
+    """
+    def __init__(self, stream, k):
+        """
+        @param stream: [file] The output stream (BgzfWriter when the output is compressed)
+        @param k: [int] The number of records kept
+        """
+        SelectedOutput.__init__(self, stream)
+        self.k = k
+        self.heap = []
+        self.nb_records = 0
+
+    def select(self, line):
+        """
+        @summary: Keep the record in the heap if it is one of the k best records seen
+        @param line: [str] The annotated record (with end of line)
+        @return: [None]
+        """
+        # The root of the heap is the worst record kept
+        self.nb_records += 1
+        ranking, final_score = mpa_values(line)
+        item = (-ranking, final_score, -self.nb_records, line)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, item)
+        elif self.k > 0:
+            heapq.heappushpop(self.heap, item)
+
+    def finish(self):
+        """
+        @summary: Write the records kept in the input order
+        @return: [None]
+        """
+        for item in sorted(self.heap, key=lambda item: -item[2]):
+            self.write_record(item[3])
+        self.heap = []
+        return None
+
+
+class RankSortedOutput(SelectedOutput):
+    """
+    @summary: Writes the annotated records sorted by priority (MPA_ranking ascending then MPA_final_score descending,
+    the input order for equal values) with an external merge sort: the records are sorted by runs in memory, the runs
+    are written in temporary files and merged at the end.
+    """
+    def __init__(self, stream, buffer_size=DEFAULT_SORT_BUFFER, temporary_directory=None):
+        """
+        @param stream: [file] The output stream (not indexed: the records are not sorted by position)
+        @param buffer_size: [int] The size of the records sorted in memory (MB)
+        @param temporary_directory: [str] The directory of the sorted runs [Default: directory of tempfile]
+        """
+        SelectedOutput.__init__(self, stream)
+        self.buffer_size = buffer_size * 1024 * 1024
+        self.temporary_directory = temporary_directory
+        self.buffer = []
+        self.buffered = 0
+        self.runs = []
+
+    def select(self, line):
+        """
+        @summary: Keep the record in memory (sorted and written in a temporary file when the buffer is full)
+        @param line: [str] The annotated record (with end of line)
+        @return: [None]
+        """
+        self.buffer.append(line)
+        self.buffered += len(line)
+        if self.buffered >= self.buffer_size:
+            self._write_run()
+
+    def _write_run(self):
+        """
+        @summary: Sort the records in memory and write them in a temporary file
+        @return: [None]
+        """
+        run = tempfile.TemporaryFile(mode='w+', dir=self.temporary_directory)
+        run.writelines(sorted(self.buffer, key=rank_key))
+        run.seek(0)
+        self.runs.append(run)
+        self.buffer = []
+        self.buffered = 0
+        if len(self.runs) >= MAX_RUNS:
+            self._merge_runs()
+        return None
+
+    def _merge_runs(self):
+        """
+        @summary: Merge the sorted runs in one run (limits the number of opened files)
+        @return: [None]
+        """
+        run = tempfile.TemporaryFile(mode='w+', dir=self.temporary_directory)
+        run.writelines(heapq.merge(*self.runs, key=rank_key))
+        run.seek(0)
+        for merged_run in self.runs:
+            merged_run.close()
+        self.runs = [run]
+        return None
+
+    def finish(self):
+        """
+        @summary: Merge the sorted runs and write the records sorted by priority
+        @return: [None]
+        """
+        # The sort is stable and the runs are merged in the input order: equal records stay in the input order
+        if self.runs:
+            if self.buffer:
+                self._write_run()
+            records = heapq.merge(*self.runs, key=rank_key)
+        else:
+            records = sorted(self.buffer, key=rank_key)
+        for line in records:
+            self.write_record(line)
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self.buffer = []
+        return None
+
+
+class AnnotationOnlyOutput(object):
+    """
+    @summary: Text stream placed between the VCF writers and the output of the annotation-only VCF: only the header
+    lines of the format, the reference, the contigs and the MPA INFO are written, with the 8 first columns of the
+    "#CHROM" line. The records (already reduced by the engine) and their index are the ones of the output.
+    """
+    def __init__(self, stream):
+        """
+        @param stream: [file] The output stream (BgzfWriter when the output is compressed)
+        """
+        self.stream = stream
+        self.name = getattr(stream, 'name', None)
+        self.index = getattr(stream, 'index', None)
+
+    def write(self, text):
+        """
+        @summary: Write a record or a header line kept in the annotation-only VCF
+        @param text: [str] One line of the VCF (with end of line)
+        @return: [None]
+        """
+        if not text.startswith('#'):
+            self.stream.write(text)
+        elif text.startswith('#CHROM'):
+            self.stream.write('\t'.join(text.rstrip('\n').split('\t')[:8]) + '\n')
+        elif text.startswith(ANNOTATION_HEADER_PREFIXES):
+            self.stream.write(text)
+
+    def tell(self):
+        """
+        @summary: Returns the position in the output
+        @return: [int] The position (BGZF virtual offset when the output is compressed)
+        """
+        return self.stream.tell()
+
+    def flush(self):
+        """
+        @summary: Flush the output
+        @return: [None]
+        """
+        self.stream.flush()
+
+    def close(self):
+        """
+        @summary: Close the output
+        @return: [None]
+        """
+        self.stream.close()
+
+################################################################################
+#
+# FUNCTIONS
+#
+################################################################################
+def rank_key(line):
+    """
+    @summary: Returns the key of an annotated record sorted by priority
+    @param line: [str] The annotated record
+    @return: [tuple] MPA_ranking and the opposite of MPA_final_score
+    """
+    ranking, final_score = mpa_values(line)
+    return (ranking, -final_score)
+
+def mpa_values(line):
+    """
+    @summary: Returns the MPA values used to order the annotated records
+    @param line: [str] The annotated record
+    @return: [tuple] MPA_ranking (int) and MPA_final_score (float)
+    """
+    return (int(MPA_RANKING_PATTERN.search(line).group(1)), float(MPA_FINAL_SCORE_PATTERN.search(line).group(1)))
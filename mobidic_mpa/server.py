@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+__author__ = 'Mobidic'
+__authors__ = ['Henri Pegeot','Kevin Yauy','Charles Van Goethem','David Baux']
+__copyright__ = 'Copyright (C) 2019'
+__license__ = 'Academic License Agreement'
+__version__ = '1.1.2'
+__email__ = 'h-pegeot@chu-montpellier.fr'
+__status__ = 'prod'
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import io         # streams of the requests
+import os         # os command
+import gzip       # compressed requests
+import socketserver # unix socket server
+import http.server # HTTP requests
+
+import vcf        # read vcf => PyVCF :https://pyvcf.readthedocs.io/en/latest/
+
+import mobidic_mpa
+from mobidic_mpa import rawvcf # raw-text VCF engine
+from mobidic_mpa import stats as mpa_stats # time by stage
+
+################################################################################
+#
+# CONSTANTS
+#
+################################################################################
+# Path of the annotation requests
+ANNOTATE_PATH = '/annotate'
+
+# Path of the availability requests
+HEALTH_PATH = '/health'
+
+################################################################################
+#
+# CLASS
+#
+################################################################################
+class AnnotationHandler(http.server.BaseHTTPRequestHandler):
+    """
+    @summary: Handles the requests of the service: POST /annotate with a VCF annotated by ANNOVAR (gzip accepted with
+    "Content-Encoding: gzip", sent with a Content-Length or with "Transfer-Encoding: chunked") returns the VCF annotated
+    with MPA score ; GET /health returns "OK".
+    The options of the annotation (raw_samples, vectorized, schema) and the logger are attributes of the server.
+    """
+    def address_string(self):
+        # No address for the clients of a unix socket
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        self.server.log.debug("%s - %s" % (self.address_string(), format % args))
+
+    def send_text(self, code, text):
+        """
+        @summary: Send a short text response
+        @param code: [int] The HTTP status
+        @param text: [str] The body of the response
+        @return: [None]
+        """
+        body = (text + '\n').encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return None
+
+    def do_GET(self):
+        if self.path == HEALTH_PATH:
+            self.send_text(200, 'OK')
+        else:
+            self.send_text(404, 'Unknown path: ' + self.path)
+
+    def do_POST(self):
+        if self.path.split('?')[0] != ANNOTATE_PATH:
+            self.send_text(404, 'Unknown path: ' + self.path)
+            return None
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            try:
+                body = io.BytesIO(read_chunked(self.rfile))
+            except ValueError as e:
+                self.send_text(400, str(e))
+                return None
+        elif self.headers.get('Content-Length') is not None:
+            body = io.BytesIO(self.rfile.read(int(self.headers['Content-Length'])))
+        else:
+            self.send_text(411, 'The length of the VCF is needed (Content-Length or "Transfer-Encoding: chunked")')
+            return None
+        self.headers_sent = False
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.GzipFile(fileobj=body)
+        output = io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True)
+        try:
+            annotate_stream(io.TextIOWrapper(body, encoding='utf-8'), output, self.server.log,
+                self.server.raw_samples, self.server.vectorized, self.send_annotated, self.server.schema)
+        except (Exception, SystemExit) as e:
+            if not self.headers_sent:
+                self.send_text(400, str(e))
+            else:
+                self.server.log.error("Annotation interrupted: " + str(e))
+        finally:
+            output.detach()
+        return None
+
+    def send_annotated(self):
+        """
+        @summary: Send the headers of the annotated VCF (once the header of the request is checked)
+        @return: [None]
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.end_headers()
+        self.headers_sent = True
+        return None
+
+
+class AnnotationServer(http.server.ThreadingHTTPServer):
+    """
+    @summary: HTTP service of annotation on a port of localhost (one thread by request).
+    """
+    def __init__(self, address, log, raw_samples=False, vectorized=False, schema=None):
+        self.log = log
+        self.raw_samples = raw_samples
+        self.vectorized = vectorized
+        self.schema = schema
+        http.server.ThreadingHTTPServer.__init__(self, address, AnnotationHandler)
+
+
+class UnixAnnotationServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    @summary: HTTP service of annotation on a unix socket (one thread by request).
+    """
+    daemon_threads = True
+
+    def __init__(self, path, log, raw_samples=False, vectorized=False, schema=None):
+        self.log = log
+        self.raw_samples = raw_samples
+        self.vectorized = vectorized
+        self.schema = schema
+        if os.path.exists(path):
+            os.remove(path)
+        socketserver.UnixStreamServer.__init__(self, path, AnnotationHandler)
+
+################################################################################
+#
+# FUNCTIONS
+#
+################################################################################
+def read_chunked(rfile):
+    """
+    @summary: Read a body sent with "Transfer-Encoding: chunked"
+    @param rfile: [file] The binary stream of the request (after the headers)
+    @return: [bytes] The body
+    """
+    chunks = []
+    while True:
+        size_line = rfile.readline()
+        try:
+            size = int(size_line.split(b';', 1)[0].strip(), 16)
+        except ValueError:
+            raise ValueError("Invalid chunk size: " + repr(size_line))
+        if size == 0:
+            break
+        chunks.append(rfile.read(size))
+        rfile.readline() # end of the chunk
+    # Trailer headers until the empty line
+    while rfile.readline().strip():
+        pass
+    return b''.join(chunks)
+
+def annotate_stream(input_stream, output_stream, log, raw_samples=False, vectorized=False, on_header=None, schema=None):
+    """
+    @summary: Annotate a VCF stream with MPA score with the raw engine (nothing is written in files).
+    @param input_stream: [file] The VCF annotated by ANNOVAR (text)
+    @param output_stream: [file] The annotated VCF (text)
+    @param log: [Logger] The logger of the script.
+    @param raw_samples: [bool] True to copy the FORMAT and sample columns without parsing them
+    @param vectorized: [bool] True to score the chunks of variants with columnar.score_batch
+    @param on_header: [function] Called once the header of the VCF is checked, before writing the annotated VCF
+    @param schema: [tuple] The INFO key of each annotation returned by compile_schema (None for the names of ANNOTATION_KEYS)
+    @return: [PipelineStats] The time by stage and the counters of the annotation
+    """
+    stats = mpa_stats.PipelineStats()
+    vcf_reader = vcf.Reader(input_stream, compressed=False)
+    mobidic_mpa.add_mpa_infos(vcf_reader)
+    mobidic_mpa.check_annotation(vcf_reader.infos, schema)
+    if on_header is not None:
+        on_header()
+    vcf_writer = vcf.Writer(output_stream, vcf_reader)
+    rawvcf.annotate(vcf_reader, vcf_writer, log, raw_samples, 1, None, vectorized, stats, schema=schema)
+    vcf_writer.flush()
+    stats.stop()
+    return stats
+
+################################################################################
+#
+# PROCESS
+#
+################################################################################
+def main(args, log):
+    """
+    @summary: Serve the annotation with MPA score on a unix socket or on a port of localhost until interrupted.
+    @param args: [Namespace] The namespace extract from the script arguments (socket or port, engine, raw_samples, schema, annotation_key).
+    @param log: [Logger] The logger of the script.
+    @return: [int] 0 when the service is stopped ; 1 if it cannot start
+    """
+    mobidic_mpa.log = log
+    engine = getattr(args, 'engine', 'raw')
+    if engine == 'numpy' and mobidic_mpa.columnar.numpy is None:
+        log.error("The numpy engine needs the python package numpy (pip install numpy)")
+        return 1
+    vectorized = engine == 'numpy'
+    raw_samples = getattr(args, 'raw_samples', False)
+    try:
+        schema = mobidic_mpa.args_schema(args)
+    except (IOError, ValueError) as e:
+        log.error(str(e))
+        return 1
+    if getattr(args, 'socket', None):
+        server = UnixAnnotationServer(args.socket, log, raw_samples, vectorized, schema)
+        log.info("Listen on unix socket " + args.socket)
+    else:
+        server = AnnotationServer(('127.0.0.1', args.port), log, raw_samples, vectorized, schema)
+        log.info("Listen on http://127.0.0.1:{}{}".format(server.server_address[1], ANNOTATE_PATH))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info("Service stopped")
+    finally:
+        server.server_close()
+        if getattr(args, 'socket', None) and os.path.exists(args.socket):
+            os.remove(args.socket)
+    return 0
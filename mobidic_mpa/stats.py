@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+__author__ = 'Mobidic'
+__authors__ = ['Henri Pegeot','Kevin Yauy','Charles Van Goethem','David Baux']
+__copyright__ = 'Copyright (C) 2019'
+__license__ = 'Academic License Agreement'
+__version__ = '1.1.2'
+__email__ = 'h-pegeot@chu-montpellier.fr'
+__status__ = 'prod'
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import os         # os command
+import json       # stats report
+import time       # timers
+
+################################################################################
+#
+# CONSTANTS
+#
+################################################################################
+# Stages of the annotation
+STAGES = ['read', 'check', 'score', 'write']
+
+# Counters of the annotation
+COUNTERS = ['records', 'annotated', 'skipped', 'rejected', 'cached', 'memo_hits', 'memo_misses', 'prefiltered']
+
+################################################################################
+#
+# CLASS
+#
+################################################################################
+class PipelineStats(object):
+    """
+    @summary: Time spent by stage and counters of an annotation. With several processes, the times of the stages are summed over the processes.
+    """
+    def __init__(self):
+        self.seconds = dict((stage, 0.0) for stage in STAGES)
+        self.counts = dict((counter, 0) for counter in COUNTERS)
+        self.start = time.perf_counter()
+        self.end = None
+
+    def add(self, stage, seconds):
+        """
+        @summary: Add time to a stage
+        @param stage: [str] The stage (see STAGES)
+        @param seconds: [float] The time spent
+        @return: [None]
+        """
+        self.seconds[stage] += seconds
+
+    def count(self, counter, number=1):
+        """
+        @summary: Increment a counter
+        @param counter: [str] The counter (see COUNTERS)
+        @param number: [int] The increment
+        @return: [None]
+        """
+        self.counts[counter] += number
+
+    def timed(self, iterator, stage):
+        """
+        @summary: Iterate and add the time spent to get each item to a stage
+        @param iterator: [iterator] The iterator (reader of the variants...)
+        @param stage: [str] The stage (see STAGES)
+        @return: [generator] The items of the iterator
+        """
+        iterator = iter(iterator)
+        clock = time.perf_counter
+        seconds = self.seconds
+        while True:
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                seconds[stage] += clock() - start
+                return
+            seconds[stage] += clock() - start
+            yield item
+
+    def merge(self, values):
+        """
+        @summary: Add the times and the counters of another process
+        @param values: [tuple] The values returned by values() in the other process
+        @return: [None]
+        """
+        seconds, counts = values
+        for stage in seconds:
+            self.seconds[stage] += seconds[stage]
+        for counter in counts:
+            self.counts[counter] += counts[counter]
+
+    def values(self):
+        """
+        @summary: Returns the times and the counters (to be sent to another process)
+        @return: [tuple] The times by stage and the counters
+        """
+        return (self.seconds, self.counts)
+
+    def stop(self):
+        """
+        @summary: Stop the clock of the annotation
+        @return: [float] The elapsed time
+        """
+        self.end = time.perf_counter()
+        return self.end - self.start
+
+    def report(self, **infos):
+        """
+        @summary: Returns the stats of the annotation
+        @param infos: [dict] Additional information (input, output, engine...)
+        @return: [dict] The stats
+        """
+        elapsed = (self.end or time.perf_counter()) - self.start
+        report = dict(infos)
+        report.update(self.counts)
+        for name in ('input', 'output'):
+            if name in infos and os.path.isfile(infos[name]):
+                report[name + '_bytes'] = os.path.getsize(infos[name])
+        report['seconds'] = dict((stage, round(self.seconds[stage], 6)) for stage in STAGES)
+        report['seconds']['total'] = round(elapsed, 6)
+        report['records_per_s'] = round(self.counts['records'] / elapsed, 3) if elapsed > 0 else None
+        if 'input_bytes' in report and elapsed > 0:
+            report['input_bytes_per_s'] = round(report['input_bytes'] / elapsed, 3)
+        return report
+
+    def write_json(self, filename, **infos):
+        """
+        @summary: Write the stats of the annotation in a JSON file
+        @param filename: [str] Path of the JSON file
+        @param infos: [dict] Additional information (input, output, engine...)
+        @return: [None]
+        """
+        with open(filename, 'w') as handle:
+            json.dump(self.report(**infos), handle, indent=2, sort_keys=True)
+            handle.write('\n')
+        return None
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+__author__ = 'Mobidic'
+__authors__ = ['Henri Pegeot','Kevin Yauy','Charles Van Goethem','David Baux']
+__copyright__ = 'Copyright (C) 2019'
+__license__ = 'Academic License Agreement'
+__version__ = '1.1.2'
+__email__ = 'h-pegeot@chu-montpellier.fr'
+__status__ = 'prod'
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+try:
+    import pyarrow    # columnar tables (optional: only needed by the table output)
+    import pyarrow.parquet
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+################################################################################
+#
+# CONSTANTS
+#
+################################################################################
+# Number of variants by batch written in the table
+BATCH_SIZE = 65536
+
+# INFO of the gene of the variant
+GENE_KEY = 'Gene.refGene'
+
+# Extensions of the tables written in the Arrow IPC format (Parquet for the other extensions)
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+
+# Values of INFO not available
+MISSING_VALUES = frozenset(['.', ''])
+
+################################################################################
+#
+# CLASS
+#
+################################################################################
+class TableWriter(object):
+    """
+    @summary: Writes the annotated variants in a columnar table (Parquet, or Arrow IPC for the names ending with
+    ".arrow", ".feather" or ".ipc") by batches: CHROM, POS, REF, ALT, gene, the MPA values as typed columns and
+    selected INFO as strings.
+    """
+    def __init__(self, filename, info_keys=(), batch_size=BATCH_SIZE):
+        """
+        @param filename: [str] Path of the table
+        @param info_keys: [list] The INFO added as columns (missing values are null)
+        @param batch_size: [int] The number of variants by batch
+        """
+        self.filename = filename
+        self.info_keys = list(info_keys)
+        self.batch_size = batch_size
+        string = pyarrow.string()
+        self.schema = pyarrow.schema(
+            [
+                ('CHROM', string), ('POS', pyarrow.int64()), ('REF', string), ('ALT', string), ('gene', string),
+                ('MPA_impact', string), ('MPA_ranking', pyarrow.int32()), ('MPA_final_score', pyarrow.float64()),
+                ('MPA_adjusted', pyarrow.float64()), ('MPA_available', pyarrow.int32()), ('MPA_deleterious', pyarrow.int32())
+            ] + [(key, string) for key in self.info_keys]
+        )
+        self.converters = {
+            'MPA_impact': str,
+            'MPA_ranking': int,
+            'MPA_final_score': float,
+            'MPA_adjusted': float,
+            'MPA_available': int,
+            'MPA_deleterious': int
+        }
+        self.read_keys = set(self.converters) | set(self.info_keys) | set([GENE_KEY])
+        self.columns = dict((name, []) for name in self.schema.names)
+        self.nb_buffered = 0
+        if filename.endswith(ARROW_EXTENSIONS):
+            self.writer = pyarrow.ipc.new_file(filename, self.schema)
+        else:
+            self.writer = pyarrow.parquet.ParquetWriter(filename, self.schema)
+
+    def add_line(self, line):
+        """
+        @summary: Add an annotated record of the VCF
+        @param line: [str] The annotated record
+        @return: [None]
+        """
+        columns = line.split('\t', 8)
+        values = dict()
+        for entry in columns[7].rstrip('\n').split(';'):
+            key, sep, value = entry.partition('=')
+            if key in self.read_keys:
+                values[key] = value
+        return self.add_row(columns[0], int(columns[1]), columns[3], columns[4].rstrip('\n'), values)
+
+    def add_row(self, chrom, pos, ref, alt, values):
+        """
+        @summary: Add an annotated variant
+        @param chrom: [str] The CHROM column
+        @param pos: [int] The POS column
+        @param ref: [str] The REF column
+        @param alt: [str] The ALT column
+        @param values: [dict] The INFO values as written in the VCF by key (with the MPA values)
+        @return: [None]
+        """
+        gene = values.get(GENE_KEY)
+        if gene is not None:
+            gene = gene.split(',', 1)[0]
+        table_columns = self.columns
+        table_columns['CHROM'].append(chrom)
+        table_columns['POS'].append(pos)
+        table_columns['REF'].append(ref)
+        table_columns['ALT'].append(alt)
+        table_columns['gene'].append(missing_to_none(gene))
+        for key, converter in self.converters.items():
+            table_columns[key].append(converter(values[key]))
+        for key in self.info_keys:
+            table_columns[key].append(missing_to_none(values.get(key)))
+        self.nb_buffered += 1
+        if self.nb_buffered >= self.batch_size:
+            self.write_batch()
+        return None
+
+    def write_batch(self):
+        """
+        @summary: Write the buffered variants in the table
+        @return: [None]
+        """
+        if self.nb_buffered == 0:
+            return None
+        arrays = [pyarrow.array(self.columns[field.name], type=field.type) for field in self.schema]
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+        for name in self.columns:
+            self.columns[name] = []
+        self.nb_buffered = 0
+        return None
+
+    def close(self):
+        """
+        @summary: Write the last variants and close the table
+        @return: [None]
+        """
+        self.write_batch()
+        self.writer.close()
+        return None
+
+
+class TableOutput(object):
+    """
+    @summary: Text stream placed between the VCF writers and the output: each line is written in the output and each
+    annotated record is also added in the table. The position in the output and its index are the ones of the output.
+    """
+    def __init__(self, stream, table_writer):
+        """
+        @param stream: [file] The output stream (BgzfWriter when the output is compressed)
+        @param table_writer: [TableWriter] The table of the annotated variants
+        """
+        self.stream = stream
+        self.table_writer = table_writer
+        self.name = getattr(stream, 'name', None)
+        self.index = getattr(stream, 'index', None)
+
+    def write(self, text):
+        """
+        @summary: Write a line in the output and add the annotated records in the table
+        @param text: [str] One line of the VCF (with end of line)
+        @return: [None]
+        """
+        self.stream.write(text)
+        if not text.startswith('#'):
+            self.table_writer.add_line(text)
+
+    def tell(self):
+        """
+        @summary: Returns the position in the output
+        @return: [int] The position (BGZF virtual offset when the output is compressed)
+        """
+        return self.stream.tell()
+
+    def flush(self):
+        """
+        @summary: Flush the output
+        @return: [None]
+        """
+        self.stream.flush()
+
+    def close(self):
+        """
+        @summary: Close the output and the table
+        @return: [None]
+        """
+        self.stream.close()
+        self.table_writer.close()
+
+
+class TableOnlyOutput(object):
+    """
+    @summary: Stream replacing the VCF output when only the table is written: the header lines are dropped and the rows
+    built by the raw engine (see RawRecordFormatter) are added in the table without formatting the VCF.
+    """
+    def __init__(self, table_writer):
+        """
+        @param table_writer: [TableWriter] The table of the annotated variants
+        """
+        self.table_writer = table_writer
+        self.name = table_writer.filename
+        self.index = None
+
+    def table_keys(self):
+        """
+        @summary: Returns the INFO read from each variant in addition to the MPA values
+        @return: [list] The INFO keys
+        """
+        return [GENE_KEY] + self.table_writer.info_keys
+
+    def write(self, row):
+        """
+        @summary: Add a row in the table (the header lines are dropped)
+        @param row: [tuple/str] The CHROM, POS, REF, ALT and the INFO values of a variant, or a header line
+        @return: [None]
+        """
+        if isinstance(row, tuple):
+            self.table_writer.add_row(*row)
+
+    def flush(self):
+        """
+        @summary: Nothing to flush (the rows are written by batches)
+        @return: [None]
+        """
+        return None
+
+    def close(self):
+        """
+        @summary: Write the last rows and close the table
+        @return: [None]
+        """
+        self.table_writer.close()
+
+################################################################################
+#
+# FUNCTIONS
+#
+################################################################################
+def missing_to_none(value):
+    """
+    @summary: Returns None for the values not available
+    @param value: [str/None] The raw value
+    @return: [str/None] The value or None
+    """
+    if value is None or value in MISSING_VALUES:
+        return None
+    return value
@@ -36,6 +36,10 @@ setuptools.setup(
         "Topic :: Scientific/Engineering :: Bio-Informatics",
     ],
     install_requires=['pyvcf==0.6.8'],
+    extras_require={
+        'numpy': ['numpy'],
+        'parquet': ['pyarrow'],
+    },
     entry_points={
         "console_scripts": [
             "mpa_main=mobidic_mpa:main"
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import gzip
+import os
+import tempfile
+import unittest
+
+from mobidic_mpa import bgzf
+
+################################################################################
+#
+# TESTS
+#
+################################################################################
+class TestBgzfWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, 'out.vcf.gz')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_flush_single_thread(self):
+        writer = bgzf.BgzfWriter(self.filename)
+        writer.write('##fileformat=VCFv4.2\n')
+        writer.flush()
+        writer.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+        writer.close()
+        with gzip.open(self.filename, 'rt') as handle:
+            self.assertEqual(handle.read(), '##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+
+    def test_flush_several_threads(self):
+        writer = bgzf.BgzfWriter(self.filename, threads=2)
+        writer.write('##fileformat=VCFv4.2\n')
+        writer.flush()
+        writer.close()
+        with gzip.open(self.filename, 'rt') as handle:
+            self.assertEqual(handle.read(), '##fileformat=VCFv4.2\n')
+
+    def write_indexed(self, filename, threads):
+        writer = bgzf.BgzfWriter(filename, 'tbi', threads=threads)
+        writer.write('##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+        max_layouts = 0
+        for position in range(1, 20001):
+            offset = writer.tell()
+            writer.write('chr1\t{}\t.\tA\tG\t.\t.\tDP={}\n'.format(position * 10, position))
+            writer.index.add_record('chr1', position * 10, 'A', None, offset, writer.tell())
+            if threads > 1:
+                max_layouts = max(max_layouts, len(writer.layouts))
+        writer.close()
+        return max_layouts
+
+    def test_index_several_threads(self):
+        self.write_indexed(self.filename, 1)
+        threaded_filename = os.path.join(self.tmp_dir.name, 'threaded.vcf.gz')
+        max_layouts = self.write_indexed(threaded_filename, 4)
+        for extension in ('', '.tbi'):
+            with open(self.filename + extension, 'rb') as expected, open(threaded_filename + extension, 'rb') as threaded:
+                self.assertEqual(threaded.read(), expected.read())
+        # Only the layouts of the blocks in compression are kept
+        self.assertLessEqual(max_layouts, 2 * 4 + 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import os
+import sys
+import gzip
+import tempfile
+import subprocess
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmark'))
+import synthetic_vcf
+
+################################################################################
+#
+# CONSTANTS
+#
+################################################################################
+# Engines and modes which must write the same VCF as the pyvcf engine
+MODES = [
+    ['-e', 'raw'],
+    ['-e', 'numpy'],
+    ['-e', 'raw', '--threads', '2'],
+    ['-e', 'numpy', '--threads', '2'],
+    ['-e', 'raw', '--pipeline'],
+    ['-e', 'numpy', '--pipeline']
+]
+
+################################################################################
+#
+# TESTS
+#
+################################################################################
+class TestEngines(unittest.TestCase):
+    """
+    The raw and numpy engines, alone or with processes or threads, write the same VCF as the pyvcf engine on variants
+    with missing annotations (".", "NA", empty), annotations defined twice, structural variants, insertions and deletions.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.input = os.path.join(cls.tmp_dir.name, 'input.vcf')
+        synthetic_vcf.SyntheticVCF(seed=7, edge_rate=0.5).write(cls.input, 300, 2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def annotate(self, output_name, *args):
+        output = os.path.join(self.tmp_dir.name, output_name)
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        command = [sys.executable, os.path.join(ROOT, 'scripts', 'mpa'), '-i', self.input, '-o', output, '-l', 'ERROR'] + list(args)
+        subprocess.run(command, env=env, check=True)
+        with (gzip.open(output, 'rt') if output.endswith('.gz') else open(output)) as handle:
+            return handle.read()
+
+    def test_input_edge_cases(self):
+        with open(self.input) as handle:
+            records = [line.split('\t') for line in handle if not line.startswith('#')]
+        infos = [record[7] for record in records]
+        self.assertTrue(any('SVTYPE=' in info for info in infos))
+        self.assertTrue(any(len(record[3]) != len(record[4]) and not record[4].startswith('<') for record in records))
+        self.assertTrue(any('=NA;' in info or '=NA,' in info for info in infos))
+        keys = [[entry.split('=', 1)[0] for entry in info.split(';')] for info in infos]
+        self.assertTrue(any(len(set(info_keys)) < len(info_keys) for info_keys in keys))
+
+    def test_modes(self):
+        expected = self.annotate('pyvcf.vcf', '-e', 'pyvcf')
+        self.assertEqual(len([line for line in expected.splitlines() if not line.startswith('#')]), 300)
+        for mode in MODES:
+            with self.subTest(mode=' '.join(mode)):
+                self.assertEqual(self.annotate('mode.vcf', *mode), expected)
+
+    def test_raw_samples(self):
+        expected = self.annotate('pyvcf.vcf', '-e', 'pyvcf', '--raw-samples')
+        for mode in MODES:
+            with self.subTest(mode=' '.join(mode)):
+                self.assertEqual(self.annotate('mode.vcf', '--raw-samples', *mode), expected)
+
+    def test_compressed_output(self):
+        expected = self.annotate('pyvcf.vcf', '-e', 'pyvcf')
+        self.assertEqual(self.annotate('raw.vcf.gz', '-e', 'raw', '--compress-threads', '2'), expected)
+        self.assertEqual(self.annotate('pyvcf.vcf.gz', '-e', 'pyvcf'), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import os
+import tempfile
+import unittest
+
+from mobidic_mpa import regions
+
+################################################################################
+#
+# TESTS
+#
+################################################################################
+class TestReadBed(unittest.TestCase):
+    def write_bed(self, content):
+        with tempfile.NamedTemporaryFile('w', suffix='.bed', delete=False) as handle:
+            handle.write(content)
+        self.addCleanup(os.remove, handle.name)
+        return handle.name
+
+    def test_regions(self):
+        filename = self.write_bed("track name=test\n#comment\n\nchr1\t10\t20\tname\nchr2\t0\t5\n")
+        self.assertEqual(regions.read_bed(filename), [('chr1', 10, 20), ('chr2', 0, 5)])
+
+    def test_invalid_lines(self):
+        for line in ("chr1\t10\n", "chr1\tten\t20\n", "chr1 10 20\n"):
+            filename = self.write_bed("chr1\t1\t2\n" + line)
+            with self.assertRaises(ValueError) as context:
+                regions.read_bed(filename)
+            self.assertIn("Line 2 of the BED " + filename, str(context.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
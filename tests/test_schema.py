@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import unittest
+
+import mobidic_mpa
+
+################################################################################
+#
+# TESTS
+#
+################################################################################
+class TestSchema(unittest.TestCase):
+    def test_compile_not_available(self):
+        schema = dict(mobidic_mpa.compile_schema({'Func.refGene': '.', 'CLNSIG': 'CLINSIG'}))
+        self.assertIsNone(schema['Func.refGene'])
+        self.assertEqual(schema['CLNSIG'], 'CLINSIG')
+        self.assertNotIn('Func.refGene', mobidic_mpa.schema_info_keys(tuple(schema.items())))
+
+    def test_compile_unknown_annotation(self):
+        with self.assertRaises(ValueError):
+            mobidic_mpa.compile_schema({'Func.ensGene': 'Func'})
+
+    def test_func_not_available(self):
+        self.assertEqual(mobidic_mpa.classify_func(None), mobidic_mpa.FuncImpacts(exonic=False, splicing=False))
+        splices_scores = {'ADA': None, 'RF': None, 'spliceAI': None}
+        self.assertFalse(mobidic_mpa.is_splice_impact(splices_scores, True, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import unittest
+
+from mobidic_mpa.scorer import Scorer
+
+################################################################################
+#
+# TESTS
+#
+################################################################################
+class TestScorer(unittest.TestCase):
+    def test_partial_mapping(self):
+        result = Scorer().score({'CLNSIG': 'Pathogenic'})
+        self.assertEqual(result.impact, 'clinvar_pathogenicity')
+        self.assertEqual(result.ranking, 1)
+
+    def test_empty_mapping(self):
+        result = Scorer().score({})
+        self.assertEqual(result.impact, 'NULL')
+        self.assertEqual(result.ranking, 10)
+        self.assertEqual(result.available, 0)
+
+    def test_partial_mappings_by_batch(self):
+        variants = [{'CLNSIG': 'Pathogenic'}, {'SIFT_pred': 'D', 'Polyphen2_HDIV_pred': 'B'}, {}]
+        self.assertEqual(Scorer().score_many(variants), [Scorer().score(variant) for variant in variants])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import io
+import unittest
+
+import vcf
+
+import mobidic_mpa
+from mobidic_mpa import selection
+
+################################################################################
+#
+# TESTS
+#
+################################################################################
+def record(position, ranking, final_score):
+    return 'chr1\t{}\t.\tA\tG\t.\t.\tMPA_final_score={};MPA_ranking={}\n'.format(position, final_score, ranking)
+
+
+class TestSelectedOutput(unittest.TestCase):
+    def test_rank_sorted(self):
+        stream = io.StringIO()
+        output = selection.RankSortedOutput(stream)
+        output.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+        for line in [record(1, 10, 0), record(2, 1, 10), record(3, 5, 8), record(4, 5, 9)]:
+            output.write(line)
+        output.finish()
+        positions = [line.split('\t')[1] for line in stream.getvalue().splitlines()[1:]]
+        self.assertEqual(positions, ['2', '4', '3', '1'])
+
+    def test_close_output_errors(self):
+        # The errors raised while the selected records are written are not hidden by vcf.Writer.close
+        vcf_reader = vcf.Reader(io.StringIO('##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'))
+        vcf_writer = vcf.Writer(selection.RankSortedOutput(io.StringIO()), vcf_reader)
+        vcf_writer.stream.write('chr1\t1\t.\tA\tG\t.\t.\tDP=3\n')
+        with self.assertRaises(AttributeError):
+            mobidic_mpa.close_output(vcf_writer)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import io
+import unittest
+
+from mobidic_mpa import server
+
+################################################################################
+#
+# TESTS
+#
+################################################################################
+class TestReadChunked(unittest.TestCase):
+    def test_chunks(self):
+        rfile = io.BytesIO(b'5\r\n##fil\r\na;ext=1\r\neformat=VC\r\n0\r\nX-Trailer: 1\r\n\r\nnext request')
+        self.assertEqual(server.read_chunked(rfile), b'##fileformat=VC')
+        self.assertEqual(rfile.read(), b'next request')
+
+    def test_invalid_size(self):
+        with self.assertRaises(ValueError):
+            server.read_chunked(io.BytesIO(b'zz\r\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2019
+#
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+import os
+import sys
+import gzip
+import json
+import tempfile
+import subprocess
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmark'))
+import synthetic_vcf
+
+################################################################################
+#
+# TESTS
+#
+################################################################################
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.tmp_dir.name, 'input.vcf')
+        synthetic_vcf.SyntheticVCF(seed=1).write(self.input, 200)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_mpa(self, *args):
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        command = [sys.executable, os.path.join(ROOT, 'scripts', 'mpa'), '-i', self.input, '-l', 'ERROR'] + list(args)
+        subprocess.run(command, env=env, check=True)
+
+    def test_compressed_trace(self):
+        for engine in ('pyvcf', 'raw'):
+            trace = os.path.join(self.tmp_dir.name, engine + '.jsonl')
+            self.run_mpa('-o', os.path.join(self.tmp_dir.name, 'output.vcf'), '-e', engine, '--trace', trace)
+            self.run_mpa('-o', os.path.join(self.tmp_dir.name, 'output.vcf'), '-e', engine, '--trace', trace + '.gz')
+            with open(trace) as handle:
+                expected = handle.read()
+            with gzip.open(trace + '.gz', 'rt') as handle:
+                self.assertEqual(handle.read(), expected)
+            self.assertEqual(len(expected.splitlines()), 200)
+            json.loads(expected.splitlines()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()